@@ -1 +1,7 @@
 VERSION = (1, 2, 0)
+
+
+def batch():
+    """ Shortcut to friendship.models.batch """
+    from friendship.models import batch
+    return batch()
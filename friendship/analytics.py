@@ -0,0 +1,308 @@
+"""
+Offline analytics over the relationship graph, see the
+`friendship_analytics` command.
+
+A job partitions its collection into `_id` ranges, maps every range in
+a process pool (projections only, no documents are built) and reduces
+the partial results into a document of `AnalyticsResult`. Partial
+results are checkpointed, so an interrupted run resumes with the ranges
+it hasn't finished. Large partial results are split across several
+documents, see PARTIAL_CHUNK_SIZE.
+
+NumPy is used for aggregation when installed.
+"""
+from __future__ import division
+
+import heapq
+from collections import defaultdict
+from multiprocessing import Pool
+
+from bson.binary import Binary
+from django.utils import timezone
+from django.utils.six.moves import cPickle as pickle
+from mongoengine import fields, Document
+
+from friendship.compat import get_user_model
+from friendship.models import Friend, Inspiration
+from friendship.settings import DB_ALIAS, QUERY_BATCH_SIZE
+from friendship.utils import chunked, reset_connections, split_id_ranges
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# bytes of a pickled partial result per document, well below the 16MB
+# BSON limit; larger partials are split into chunks
+PARTIAL_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class AnalyticsRun(Document):
+    """ Partitioning of a (possibly unfinished) job run """
+    name = fields.StringField(primary_key=True)
+    job = fields.StringField(required=True)
+    options = fields.DictField()
+    ranges = fields.ListField(fields.DictField())
+    started = fields.DateTimeField(default=timezone.now)
+
+    meta = {
+        'db_alias': DB_ALIAS,
+    }
+
+
+class AnalyticsPartition(Document):
+    """
+    Checkpoint: a chunk of the pickled partial result of a finished
+    range. Chunk 0 is written last, so it marks the range finished.
+    """
+    run = fields.StringField(required=True)
+    index = fields.IntField(required=True)
+    chunk = fields.IntField(default=0, unique_with=['run', 'index'])
+    chunks = fields.IntField(default=1)
+    partial = fields.BinaryField()
+    finished = fields.DateTimeField(default=timezone.now)
+
+    meta = {
+        'db_alias': DB_ALIAS,
+    }
+
+
+class AnalyticsResult(Document):
+    """ Result of the last finished run of a job """
+    name = fields.StringField(primary_key=True)
+    job = fields.StringField(required=True)
+    result = fields.DictField()
+    computed = fields.DateTimeField(default=timezone.now)
+
+    meta = {
+        'db_alias': DB_ALIAS,
+    }
+
+
+class AnalyticsJob(object):
+    """
+    `map` turns an `_id` range of `document` into a partial result,
+    `reduce` merges the partial results of all ranges into a dict
+    """
+    name = None
+    document = None
+
+    def __init__(self, **options):
+        self.options = options
+
+    def queryset(self, after=None, until=None):
+        qs = self.document.objects.all()
+        if after is not None:
+            qs = qs.filter(id__gt=after)
+        if until is not None:
+            qs = qs.filter(id__lte=until)
+        return qs
+
+    def map(self, after, until):
+        raise NotImplementedError
+
+    def reduce(self, partials):
+        raise NotImplementedError
+
+
+def count_by(qs, field):
+    counts = defaultdict(int)
+    for doc in qs.only(field).as_pymongo().batch_size(QUERY_BATCH_SIZE):
+        counts[doc[field]] += 1
+    return counts
+
+
+def merge_counts(partials):
+    counts = defaultdict(int)
+    for partial in partials:
+        for key, count in partial.items():
+            counts[key] += count
+    return counts
+
+
+class DegreeDistribution(AnalyticsJob):
+    """ How many users (of those with friends) have N friends """
+    name = 'degree'
+    document = Friend
+
+    def map(self, after, until):
+        return count_by(self.queryset(after, until), 'from_user')
+
+    def reduce(self, partials):
+        degrees = list(merge_counts(partials).values())
+        if not degrees:
+            return {'users': 0, 'mean': 0, 'max': 0, 'histogram': {}}
+
+        if numpy is not None:
+            degrees = numpy.array(degrees, dtype=numpy.int64)
+            histogram = numpy.bincount(degrees)
+            return {
+                'users': int(degrees.size),
+                'mean': float(degrees.mean()),
+                'max': int(degrees.max()),
+                'histogram': dict((str(degree), int(users))
+                                  for degree, users in enumerate(histogram) if users),
+            }
+
+        histogram = defaultdict(int)
+        for degree in degrees:
+            histogram[str(degree)] += 1
+        return {
+            'users': len(degrees),
+            'mean': sum(degrees) / len(degrees),
+            'max': max(degrees),
+            'histogram': dict(histogram),
+        }
+
+
+class TopInfluencers(AnalyticsJob):
+    """ Users with the most followers """
+    name = 'influencers'
+    document = Inspiration
+
+    def map(self, after, until):
+        return count_by(self.queryset(after, until), 'inspired_by')
+
+    def reduce(self, partials):
+        counts = merge_counts(partials)
+        top = self.options.get('top') or 100
+        return {
+            'top': [{'user': user_pk, 'followers': followers}
+                    for user_pk, followers in heapq.nlargest(
+                        top, counts.items(), key=lambda item: item[1])],
+        }
+
+
+class ClusteringCoefficient(AnalyticsJob):
+    """
+    Average local clustering coefficient of users with 2+ friends.
+    Every edge (u, v) of a range adds the number of common friends of
+    u and v to u, which sums to twice the triangles of u.
+    """
+    name = 'clustering'
+    document = Friend
+
+    def map(self, after, until):
+        edges = [(e['from_user'], e['to_user']) for e in self.queryset(after, until)
+                 .only('from_user', 'to_user').as_pymongo().batch_size(QUERY_BATCH_SIZE)]
+
+        users = set()
+        for from_pk, to_pk in edges:
+            users.update((from_pk, to_pk))
+
+        adjacency = defaultdict(set)
+        for chunk in chunked(list(users), QUERY_BATCH_SIZE):
+            for e in Friend.objects.filter(from_user__in=chunk)\
+                    .only('from_user', 'to_user').as_pymongo():
+                adjacency[e['from_user']].add(e['to_user'])
+
+        partial = {}
+        for from_pk, to_pk in edges:
+            common, degree = partial.get(from_pk, (0, len(adjacency[from_pk])))
+            partial[from_pk] = (common + len(adjacency[from_pk] & adjacency[to_pk]), degree)
+        return partial
+
+    def reduce(self, partials):
+        common, degrees = defaultdict(int), {}
+        for partial in partials:
+            for user_pk, (user_common, degree) in partial.items():
+                common[user_pk] += user_common
+                degrees[user_pk] = degree
+
+        users = [pk for pk, degree in degrees.items() if degree > 1]
+        if not users:
+            return {'users': 0, 'average': 0}
+
+        if numpy is not None:
+            c = numpy.array([common[pk] for pk in users], dtype=numpy.float64)
+            k = numpy.array([degrees[pk] for pk in users], dtype=numpy.float64)
+            average = float((c / (k * (k - 1))).mean())
+        else:
+            average = sum(common[pk] / (degrees[pk] * (degrees[pk] - 1))
+                          for pk in users) / len(users)
+
+        return {'users': len(users), 'average': average}
+
+
+JOBS = dict((job.name, job) for job in (
+    DegreeDistribution,
+    TopInfluencers,
+    ClusteringCoefficient,
+))
+
+
+def init_worker():
+    """ `multiprocessing.Pool` initializer of analytics processes """
+    reset_connections([Friend, Inspiration, AnalyticsPartition, get_user_model()])
+
+
+def run_partition(args):
+    """ Pool task: map a range and checkpoint the partial result """
+    job_name, options, run_name, index, after, until = args
+    partial = JOBS[job_name](**options).map(after, until)
+
+    data = pickle.dumps(partial, pickle.HIGHEST_PROTOCOL)
+    pieces = [data[start:start + PARTIAL_CHUNK_SIZE]
+              for start in range(0, len(data), PARTIAL_CHUNK_SIZE)]
+    for chunk in list(range(1, len(pieces))) + [0]:
+        AnalyticsPartition.objects(run=run_name, index=index, chunk=chunk).update_one(
+            upsert=True,
+            set__partial=Binary(pieces[chunk]),
+            set__chunks=len(pieces),
+            set__finished=timezone.now())
+    return index
+
+
+def load_partial(run_name, index):
+    """ Unpickle the checkpointed partial result of a range """
+    pieces = list(AnalyticsPartition.objects(run=run_name, index=index).order_by('chunk'))
+    # chunk 0 knows how many chunks are current, an interrupted earlier
+    # attempt may have left more
+    return pickle.loads(b''.join(bytes(p.partial) for p in pieces[:pieces[0].chunks]))
+
+
+def run_job(job_name, parts=8, workers=4, run_name=None, restart=False,
+            progress=None, **options):
+    """
+    Run (or resume) a job and store its result under `run_name`
+    (the job name by default). `progress(done, total)` is called
+    whenever a range is finished.
+    """
+    job = JOBS[job_name](**options)
+    run_name = run_name or job_name
+
+    run = AnalyticsRun.objects(pk=run_name).first()
+    if restart or run is None or run.job != job_name or run.options != options:
+        AnalyticsPartition.objects(run=run_name).delete()
+        run = AnalyticsRun(
+            name=run_name, job=job_name, options=options,
+            ranges=[{'after': after, 'until': until}
+                    for after, until in split_id_ranges(job.queryset(), parts)])
+        run.save()
+
+    done = set(p['index'] for p in AnalyticsPartition.objects(run=run_name, chunk=0)
+               .only('index').as_pymongo())
+    tasks = [(job_name, options, run_name, index, r['after'], r['until'])
+             for index, r in enumerate(run.ranges) if index not in done]
+
+    if tasks:
+        pool = Pool(workers, initializer=init_worker)
+        try:
+            for index in pool.imap_unordered(run_partition, tasks):
+                done.add(index)
+                if progress is not None:
+                    progress(len(done), len(run.ranges))
+        finally:
+            pool.close()
+            pool.join()
+
+    result = job.reduce(load_partial(run_name, index) for index in sorted(done))
+
+    AnalyticsResult.objects(pk=run_name).update_one(
+        upsert=True, set__job=job_name, set__result=result,
+        set__computed=timezone.now())
+    AnalyticsPartition.objects(run=run_name).delete()
+    run.delete()
+
+    return result
@@ -6,3 +6,63 @@ except ImportError:
     except ImportError:
         from mongoengine.django.auth import User
         get_user_model = lambda: User
+
+
+READ_PREFERENCES = {
+    'primary': 'PRIMARY',
+    'primaryPreferred': 'PRIMARY_PREFERRED',
+    'secondary': 'SECONDARY',
+    'secondaryPreferred': 'SECONDARY_PREFERRED',
+    'nearest': 'NEAREST',
+}
+
+
+def get_read_preference(mode, max_staleness=None):
+    """ Build pymongo read preference from its mode name """
+    from django.core.exceptions import ImproperlyConfigured
+    from pymongo import ReadPreference
+
+    if mode not in READ_PREFERENCES:
+        raise ImproperlyConfigured("Unknown read preference '%s'" % mode)
+
+    preference = getattr(ReadPreference, READ_PREFERENCES[mode])
+    if max_staleness and mode != 'primary':
+        try:
+            preference = preference.__class__(max_staleness=max_staleness)
+        except TypeError:
+            raise ImproperlyConfigured(
+                "Bounded staleness requires pymongo >= 3.4")
+    return preference
+
+
+try:
+    from django.utils.module_loading import import_string
+except ImportError:
+    from django.utils.module_loading import import_by_path as import_string
+
+
+try:
+    from django.core.cache import caches
+except ImportError:
+    # Django < 1.7
+    from django.core.cache import get_cache
+
+    class _Caches(dict):
+        def __missing__(self, alias):
+            self[alias] = get_cache(alias)
+            return self[alias]
+
+    caches = _Caches()
+
+
+class CacheProxy(object):
+    """
+    Looks up the cache of an alias on every access, like
+    django.core.cache.cache does for the default cache
+    """
+
+    def __init__(self, alias):
+        self._alias = alias
+
+    def __getattr__(self, name):
+        return getattr(caches[self._alias], name)
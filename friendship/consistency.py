@@ -0,0 +1,148 @@
+"""
+Consistency checks of the friendship graph.
+
+`accept` writes both `Friend` edges and deletes the request with separate
+writes, so a crash in between leaves broken friendships behind. The
+functions below find and repair them one `_id` range of `Friend` at
+a time, so ranges can be checked in parallel (see the
+`check_friendship_graph` command).
+"""
+from django.utils import timezone
+
+from friendship.compat import get_user_model
+from friendship.models import (Friend, FriendshipRequest, bust_caches,
+    invalidate_summaries)
+from friendship.utils import reset_connections
+
+
+# kinds of problems reported by `check_range`
+ISSUES = (
+    'self_edges',
+    'one_directional',
+    'dangling',
+    'stale_requests',
+)
+
+
+def check_range(after=None, until=None):
+    """
+    Check `Friend` edges with `_id` in (after, until] and return
+    {'scanned': count, issue: [...]} where issues are:
+
+    * self_edges - `_id`s of edges from a user to themselves,
+    * one_directional - (from_user, to_user) edges without the reverse one,
+    * dangling - (`_id`, from_user, to_user) of edges pointing
+      to deleted users,
+    * stale_requests - (`_id`, from_user, to_user) of requests between
+      users who are already friends.
+    """
+    qs = Friend.objects.all()
+    if after is not None:
+        qs = qs.filter(id__gt=after)
+    if until is not None:
+        qs = qs.filter(id__lte=until)
+    return check_edges(qs)
+
+
+def check_users(user_pks):
+    """ Check edges from given users, see `check_range` """
+    return check_edges(Friend.objects.filter(from_user__in=list(user_pks)))
+
+
+def check_edges(queryset):
+    """ Check `Friend` edges of the queryset, see `check_range` """
+    edges = [(e['_id'], e['from_user'], e['to_user'])
+             for e in queryset.only('from_user', 'to_user').as_pymongo()]
+    result = dict((issue, []) for issue in ISSUES)
+    result['scanned'] = len(edges)
+    if not edges:
+        return result
+
+    from_pks = set(from_pk for _, from_pk, _ in edges)
+    to_pks = set(to_pk for _, _, to_pk in edges)
+
+    existing_users = set(
+        u['_id'] for u in get_user_model().objects.filter(
+            id__in=list(from_pks | to_pks)).only('id').as_pymongo())
+
+    reverse_edges = set(
+        (e['from_user'], e['to_user']) for e in Friend.objects.filter(
+            from_user__in=list(to_pks),
+            to_user__in=list(from_pks)).only('from_user', 'to_user').as_pymongo())
+
+    pairs = set()
+    for edge_pk, from_pk, to_pk in edges:
+        if from_pk == to_pk:
+            result['self_edges'].append(edge_pk)
+        elif from_pk not in existing_users or to_pk not in existing_users:
+            result['dangling'].append((edge_pk, from_pk, to_pk))
+        else:
+            pairs.add((from_pk, to_pk))
+            if (to_pk, from_pk) not in reverse_edges:
+                result['one_directional'].append((from_pk, to_pk))
+
+    if pairs:
+        requests = FriendshipRequest.objects.filter(
+            from_user__in=list(from_pks),
+            to_user__in=list(to_pks)).only('from_user', 'to_user').as_pymongo()
+        result['stale_requests'] = [
+            (r['_id'], r['from_user'], r['to_user']) for r in requests
+            if (r['from_user'], r['to_user']) in pairs]
+
+    return result
+
+
+def repair(result):
+    """
+    Fix issues found by `check_range` with a bulk write per collection:
+    self-edges, dangling edges and stale requests are deleted, missing
+    reverse edges are restored (finishing the interrupted `accept`).
+    Returns pks of users whose caches are out of date.
+    """
+    affected = set()
+
+    deleted_edges = result['self_edges'] + [pk for pk, _, _ in result['dangling']]
+    for _, from_pk, to_pk in result['dangling']:
+        affected.update((from_pk, to_pk))
+    if deleted_edges or result['one_directional']:
+        bulk = Friend._get_collection().initialize_unordered_bulk_op()
+        if deleted_edges:
+            bulk.find({'_id': {'$in': deleted_edges}}).remove()
+
+        now = timezone.now()
+        for from_pk, to_pk in result['one_directional']:
+            bulk.find({'from_user': to_pk, 'to_user': from_pk}).upsert().update_one(
+                {'$setOnInsert': {'created': now}})
+            affected.update((from_pk, to_pk))
+        bulk.execute()
+
+    if result['stale_requests']:
+        bulk = FriendshipRequest._get_collection().initialize_unordered_bulk_op()
+        bulk.find({'_id': {'$in': [pk for pk, _, _ in result['stale_requests']]}}).remove()
+        bulk.execute()
+        for _, from_pk, to_pk in result['stale_requests']:
+            affected.update((from_pk, to_pk))
+
+    return affected
+
+
+def bust_repaired(user_pks):
+    """ Bust caches of users returned by `repair` """
+    for kind in ('friends', 'requests', 'sent_requests', 'request_counts'):
+        bust_caches(kind, user_pks)
+    invalidate_summaries(user_pks)
+
+
+def init_worker():
+    """ `multiprocessing.Pool` initializer of checking processes """
+    reset_connections([Friend, FriendshipRequest, get_user_model()])
+
+
+def check_range_worker(args):
+    """
+    Pool task: check (and repair) a range, return the check result
+    and pks of repaired users
+    """
+    after, until, fix = args
+    result = check_range(after, until)
+    return result, repair(result) if fix else set()
@@ -1,5 +1,10 @@
+from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 
 
 class AlreadyExistsError(IntegrityError):
     pass
+
+
+class RateLimitExceeded(ValidationError):
+    pass
@@ -0,0 +1,190 @@
+"""
+Load harness driving the racy entry points (`add_friend`, `accept`,
+`add_blocking`, ...) from many threads and processes at once, see the
+`load_test_friendship` command.
+
+Only meant for a local mongod: it creates synthetic users, lets workers
+relate them randomly and finally checks the graph they left behind.
+"""
+import random
+import threading
+import time
+import uuid
+
+from bson import ObjectId
+from django.core.exceptions import ValidationError
+
+from friendship import consistency
+from friendship.compat import get_user_model
+from friendship.exceptions import AlreadyExistsError
+from friendship.models import (Friend, FriendshipRequest, Inspiration, Blocking,
+    RelationshipSummary, BUST_CACHES, bust_caches, cache)
+from friendship.outbox import RelationshipEvent
+from friendship.utils import reset_connections
+
+
+# refusals by design (duplicates, blocked users), not errors
+EXPECTED_ERRORS = (AlreadyExistsError, ValidationError)
+
+
+def create_users(count):
+    """ Create synthetic users, return their pks """
+    User = get_user_model()
+    run = uuid.uuid4().hex[:8]
+    pks = []
+    for i in range(count):
+        user = User(id=ObjectId())
+        for field, value in (('username', 'friendship-load-%s-%d' % (run, i)),
+                             ('email', 'friendship-load-%s-%d@example.com' % (run, i))):
+            if field in user._fields:
+                setattr(user, field, value)
+        user.save(force_insert=True)
+        pks.append(user.pk)
+    return pks
+
+
+def delete_users(user_pks):
+    """ Delete synthetic users with all their relationships and caches """
+    user_pks = list(user_pks)
+    for document, fields in ((Friend, ('from_user', 'to_user')),
+                             (FriendshipRequest, ('from_user', 'to_user')),
+                             (Blocking, ('from_user', 'to_user')),
+                             (Inspiration, ('user', 'inspired_by')),
+                             (RelationshipEvent, ('from_user', 'to_user'))):
+        for field in fields:
+            document.objects.filter(**{field + '__in': user_pks}).delete()
+
+    RelationshipSummary.objects.filter(pk__in=user_pks).delete()
+    get_user_model().objects.filter(id__in=user_pks).delete()
+
+    for kind in BUST_CACHES:
+        bust_caches(kind, user_pks)
+
+
+def accept_pending(from_user, to_user):
+    """ Accept whatever request to_user has, races with other threads """
+    request = FriendshipRequest.objects.filter(to_user=to_user).first()
+    if request is None:
+        return None
+    return request.accept()
+
+
+OPERATIONS = (
+    ('add_friend', lambda a, b: Friend.objects.add_friend(a, b)),
+    ('accept', accept_pending),
+    ('remove_friend', lambda a, b: Friend.objects.remove_friend(a, b)),
+    ('add_blocking', lambda a, b: Blocking.objects.add_blocking(a, b)),
+    ('remove_blocking', lambda a, b: Blocking.objects.remove_blocking(a, b)),
+    ('add_inspiration', lambda a, b: Inspiration.objects.add_inspiration(a, b)),
+    ('remove_inspiration', lambda a, b: Inspiration.objects.remove_inspiration(a, b)),
+)
+
+# relative frequency of OPERATIONS, mutations building the graph dominate
+WEIGHTS = (6, 6, 2, 1, 1, 3, 1)
+
+
+class Stats(object):
+    """ Per operation counts and timings, merged across threads and processes """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def operation(self, name):
+        return self.operations.setdefault(name, {
+            'count': 0, 'refused': 0, 'errors': {}, 'elapsed': 0.0})
+
+    def record(self, name, elapsed, error=None):
+        with self.lock:
+            op = self.operation(name)
+            op['count'] += 1
+            op['elapsed'] += elapsed
+            if error is None:
+                return
+            if isinstance(error, EXPECTED_ERRORS):
+                op['refused'] += 1
+            else:
+                kind = error.__class__.__name__
+                op['errors'][kind] = op['errors'].get(kind, 0) + 1
+
+    def merge(self, operations):
+        for name, other in operations.items():
+            op = self.operation(name)
+            op['count'] += other['count']
+            op['refused'] += other['refused']
+            op['elapsed'] += other['elapsed']
+            for kind, count in other['errors'].items():
+                op['errors'][kind] = op['errors'].get(kind, 0) + count
+
+
+def run_thread(users, operations, rng, stats):
+    names = [name for name, _ in OPERATIONS]
+    funcs = dict(OPERATIONS)
+    for _ in range(operations):
+        name = weighted_choice(rng, names, WEIGHTS)
+        from_user, to_user = rng.sample(users, 2)
+
+        started = time.time()
+        try:
+            funcs[name](from_user, to_user)
+        except Exception as e:
+            stats.record(name, time.time() - started, e)
+        else:
+            stats.record(name, time.time() - started)
+
+
+def weighted_choice(rng, items, weights):
+    point = rng.uniform(0, sum(weights))
+    for item, weight in zip(items, weights):
+        point -= weight
+        if point <= 0:
+            return item
+    return items[-1]
+
+
+def run_process(args):
+    """
+    Pool task: run `threads` threads doing `operations` random operations
+    each on the users, return per operation stats
+    """
+    user_pks, threads, operations, seed = args
+    users = list(get_user_model().objects.in_bulk(user_pks).values())
+    stats = Stats()
+
+    workers = [
+        threading.Thread(target=run_thread,
+                         args=(users, operations, random.Random(seed + i), stats))
+        for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return stats.operations
+
+
+def init_worker():
+    """ `multiprocessing.Pool` initializer of load processes """
+    reset_connections([Friend, FriendshipRequest, Inspiration, Blocking,
+                       RelationshipSummary, RelationshipEvent, get_user_model()])
+    # cache clients aren't fork-safe either
+    cache.close()
+
+
+def check_invariants(user_pks):
+    """
+    Return {violation: count} of the graph left by the load: consistency
+    issues of `Friend` edges plus friends who blocked one another
+    """
+    result = consistency.check_users(user_pks)
+    violations = dict((issue, len(result[issue])) for issue in consistency.ISSUES)
+
+    friends = set(
+        (e['from_user'], e['to_user']) for e in Friend.objects.filter(
+            from_user__in=user_pks).only('from_user', 'to_user').as_pymongo())
+    violations['blocked_friends'] = len([
+        b for b in Blocking.objects.filter(from_user__in=user_pks)
+            .only('from_user', 'to_user').as_pymongo()
+        if (b['from_user'], b['to_user']) in friends])
+
+    return violations
@@ -0,0 +1,21 @@
+try:
+    from django.db.models.signals import post_migrate
+except ImportError:
+    # Django < 1.7
+    from django.db.models.signals import post_syncdb as post_migrate
+
+from friendship.notifications import get_notifier
+
+
+def create_notice_types(sender, **kwargs):
+    app_config = kwargs.get('app_config')
+    if app_config is not None:
+        label = app_config.label
+    else:
+        label = sender.__name__.split('.')[-2]
+    if label == 'friendship':
+        get_notifier().create_notice_types()
+
+
+post_migrate.connect(create_notice_types,
+                     dispatch_uid="friendship_create_notice_types")
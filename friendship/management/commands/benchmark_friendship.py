@@ -0,0 +1,131 @@
+import subprocess
+import sys
+from optparse import make_option
+from timeit import default_timer
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.six.moves import cPickle as pickle
+
+from friendship.compat import get_user_model
+from friendship.models import FriendshipRequest
+from friendship.serializers import CompactSerializer, PickleSerializer
+
+
+class Command(BaseCommand):
+    help = "Benchmark friendship internals without touching the database"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--size',
+            type='int',
+            dest='size',
+            default=500,
+            help='Number of users/requests in benchmarked values'),
+        make_option('--repeat',
+            type='int',
+            dest='repeat',
+            default=50,
+            help='How many times every operation is repeated'),
+        make_option('--suite',
+            type='choice',
+            choices=['serializers', 'import'],
+            action='append',
+            dest='suites',
+            help='Run only given suites (serializers, import)'),
+    )
+
+    def handle(self, *args, **options):
+        suites = options['suites'] or ['serializers', 'import']
+        if 'serializers' in suites:
+            self.benchmark_serializers(options['size'], options['repeat'])
+        if 'import' in suites:
+            # every import is measured in a fresh interpreter
+            self.benchmark_import(max(1, options['repeat'] // 10))
+
+    def sample_users(self, size):
+        User = get_user_model()
+        users = []
+        for i in range(size):
+            user = User(id=ObjectId())
+            for field, value in (('username', 'user%d' % i),
+                                 ('email', 'user%d@example.com' % i),
+                                 ('first_name', 'First%d' % i),
+                                 ('last_name', 'Last%d' % i)):
+                if field in user._fields:
+                    setattr(user, field, value)
+            users.append(user)
+        return users
+
+    def benchmark_serializers(self, size, repeat):
+        """
+        Compare the pickled documents the cache backend stores by default
+        with the values written by CompactSerializer (pickled by the
+        backend as well)
+        """
+        users = self.sample_users(size + 1)
+        now = timezone.now()
+        values = {
+            'friends': users[1:],
+            'requests': [
+                FriendshipRequest(id=ObjectId(), from_user=user, to_user=users[0],
+                                  message='Hi, I would like to be your friend',
+                                  created=now)
+                for user in users[1:]],
+            'ids': [user.pk for user in users[1:]],
+        }
+
+        self.stdout.write("%-10s %-10s %10s %12s %12s" % (
+            'value', 'serializer', 'bytes', 'dumps, ms', 'loads, ms'))
+
+        for name, value in sorted(values.items()):
+            for label, serializer in (('pickle', PickleSerializer()),
+                                      ('compact', CompactSerializer())):
+                size_, dumps_time, loads_time = self.measure(serializer, value, repeat)
+                self.stdout.write("%-10s %-10s %10d %12.3f %12.3f" % (
+                    name, label, size_, dumps_time * 1000, loads_time * 1000))
+
+    def measure(self, serializer, value, repeat):
+        protocol = pickle.HIGHEST_PROTOCOL
+
+        started = default_timer()
+        for _ in range(repeat):
+            data = pickle.dumps(serializer.dumps(value), protocol)
+        dumps_time = (default_timer() - started) / repeat
+
+        started = default_timer()
+        for _ in range(repeat):
+            serializer.loads(pickle.loads(data))
+        loads_time = (default_timer() - started) / repeat
+
+        return len(data), dumps_time, loads_time
+
+    # run by a fresh interpreter, prints the import time of friendship.models
+    # and whether the notification app got imported along
+    IMPORT_SCRIPT = (
+        "import sys, timeit\n"
+        "started = timeit.default_timer()\n"
+        "import friendship.models\n"
+        "elapsed = timeit.default_timer() - started\n"
+        "print('%f %d' % (elapsed, 'notification.models' in sys.modules))\n"
+    )
+
+    def benchmark_import(self, repeat):
+        """
+        Measure how long importing friendship.models takes in a new
+        process, e.g. a worker which never sends notifications
+        """
+        timings = []
+        notification_imported = False
+        for _ in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', self.IMPORT_SCRIPT])
+            elapsed, imported = output.split()
+            timings.append(float(elapsed))
+            notification_imported = notification_imported or imported == b'1'
+
+        timings.sort()
+        self.stdout.write(
+            "import friendship.models: %.1f ms median, %.1f ms min of %d runs, "
+            "notification app %s" % (
+                timings[len(timings) // 2] * 1000, timings[0] * 1000, repeat,
+                'imported' if notification_imported else 'not imported'))
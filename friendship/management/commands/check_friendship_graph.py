@@ -0,0 +1,68 @@
+import time
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from friendship.consistency import (ISSUES, bust_repaired, check_range_worker,
+    init_worker)
+from friendship.models import Friend
+from friendship.utils import split_id_ranges
+
+
+class Command(BaseCommand):
+    help = "Find (and optionally repair) broken friendships"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--repair',
+            action='store_true',
+            dest='repair',
+            default=False,
+            help='Repair found issues'),
+        make_option('--workers',
+            type='int',
+            dest='workers',
+            default=4,
+            help='Number of processes'),
+        make_option('--chunk-size',
+            type='int',
+            dest='chunk_size',
+            default=10000,
+            help='Friend edges checked per task'),
+    )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        total = Friend.objects.count()
+        parts = max(1, -(-total // options['chunk_size']))
+        ranges = split_id_ranges(Friend.objects.all(), parts)
+        tasks = [(after, until, options['repair']) for after, until in ranges]
+
+        verbose = int(options['verbosity']) > 1
+        found = dict((issue, 0) for issue in ISSUES)
+        repaired = set()
+        scanned = 0
+
+        pool = Pool(options['workers'], initializer=init_worker)
+        try:
+            for result, affected in pool.imap_unordered(check_range_worker, tasks):
+                scanned += result['scanned']
+                for issue in ISSUES:
+                    found[issue] += len(result[issue])
+                repaired.update(affected)
+                if verbose:
+                    self.stdout.write("%d/%d edges checked" % (scanned, total))
+        finally:
+            pool.close()
+            pool.join()
+
+        # busted here, the cache clients of workers are gone with them
+        bust_repaired(repaired)
+
+        elapsed = time.time() - started
+        for issue in ISSUES:
+            self.stdout.write("%s: %d" % (issue, found[issue]))
+        self.stdout.write(
+            "%d edges checked in %.2fs (%.1f edges/s)%s" % (
+                scanned, elapsed, scanned / elapsed if elapsed else float(scanned),
+                ", %d users repaired" % len(repaired) if options['repair'] else ''))
@@ -0,0 +1,90 @@
+import time
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from friendship.models import FriendshipRequest, bust_caches, invalidate_summaries
+from friendship.settings import REJECTED_REQUEST_TTL, PENDING_REQUEST_TTL
+
+
+class Command(BaseCommand):
+    help = "Delete stale rejected and never answered friendship requests"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rejected-ttl',
+            type='int',
+            dest='rejected_ttl',
+            default=REJECTED_REQUEST_TTL,
+            help='Delete requests rejected more than N seconds ago'),
+        make_option('--pending-ttl',
+            type='int',
+            dest='pending_ttl',
+            default=PENDING_REQUEST_TTL,
+            help='Delete unanswered requests created more than N seconds ago'),
+        make_option('--chunk-size',
+            type='int',
+            dest='chunk_size',
+            default=1000,
+            help='How many requests are deleted per query'),
+        make_option('--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Only count stale requests'),
+    )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        criteria = []
+
+        if options['rejected_ttl']:
+            criteria.append({
+                'rejected': {'$lt': now - timedelta(seconds=options['rejected_ttl'])},
+            })
+        if options['pending_ttl']:
+            criteria.append({
+                'rejected': None,
+                'created': {'$lt': now - timedelta(seconds=options['pending_ttl'])},
+            })
+
+        if not criteria:
+            raise CommandError("Nothing to clean up: set --rejected-ttl "
+                               "and/or --pending-ttl")
+
+        stale = FriendshipRequest.objects(__raw__={'$or': criteria})
+
+        if options['dry_run']:
+            self.stdout.write("%d stale requests found" % stale.count())
+            return
+
+        stale = stale.only('from_user', 'to_user').as_pymongo()
+        receivers, senders = set(), set()
+        deleted = 0
+        started = time.time()
+
+        while True:
+            chunk = list(stale.limit(options['chunk_size']))
+            if not chunk:
+                break
+
+            deleted += FriendshipRequest.objects(
+                id__in=[r['_id'] for r in chunk]).delete()
+            receivers.update(r['to_user'] for r in chunk)
+            senders.update(r['from_user'] for r in chunk)
+
+            if int(options['verbosity']) > 1:
+                self.stdout.write("%d requests deleted" % deleted)
+
+        # each affected user gets a single cache bust
+        bust_caches('requests', receivers)
+        bust_caches('request_counts', receivers)
+        invalidate_summaries(receivers)
+        bust_caches('sent_requests', senders)
+
+        elapsed = time.time() - started
+        self.stdout.write(
+            "%d requests deleted in %.2fs (%.1f requests/s), caches of %d users busted" % (
+                deleted, elapsed, deleted / elapsed if elapsed else float(deleted),
+                len(receivers | senders)))
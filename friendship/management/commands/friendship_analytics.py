@@ -0,0 +1,60 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from friendship.analytics import JOBS, run_job
+
+
+class Command(BaseCommand):
+    help = ("Compute degree distribution, clustering coefficient and top "
+            "influencers of the relationship graph into AnalyticsResult")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--job',
+            type='choice',
+            choices=sorted(JOBS),
+            action='append',
+            dest='jobs',
+            help='Run only given jobs (%s)' % ', '.join(sorted(JOBS))),
+        make_option('--parts',
+            type='int',
+            dest='parts',
+            default=64,
+            help='Number of _id ranges every collection is split into'),
+        make_option('--workers',
+            type='int',
+            dest='workers',
+            default=4,
+            help='Number of processes'),
+        make_option('--top',
+            type='int',
+            dest='top',
+            default=100,
+            help='Number of top influencers'),
+        make_option('--restart',
+            action='store_true',
+            dest='restart',
+            default=False,
+            help='Discard checkpoints of interrupted runs'),
+    )
+
+    def handle(self, *args, **options):
+        verbose = int(options['verbosity']) > 1
+
+        for job_name in options['jobs'] or sorted(JOBS):
+            job_options = {'top': options['top']} if job_name == 'influencers' else {}
+
+            def progress(done, total):
+                if verbose:
+                    self.stdout.write("%s: %d/%d ranges" % (job_name, done, total))
+
+            started = time.time()
+            result = run_job(job_name, parts=options['parts'],
+                             workers=options['workers'], restart=options['restart'],
+                             progress=progress, **job_options)
+
+            self.stdout.write("%s finished in %.2fs: %s" % (
+                job_name, time.time() - started,
+                ', '.join('%s=%s' % (key, value) for key, value in sorted(result.items())
+                          if not isinstance(value, (list, dict)))))
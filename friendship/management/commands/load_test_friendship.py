@@ -0,0 +1,100 @@
+import time
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from friendship.loadtest import (Stats, create_users, delete_users, run_process,
+    init_worker, check_invariants)
+
+
+class Command(BaseCommand):
+    help = ("Drive add_friend, accept, add_blocking and friends from many "
+            "threads and processes, report throughput, errors and broken "
+            "invariants. Creates and deletes synthetic users, use against "
+            "a local database only.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--users',
+            type='int',
+            dest='users',
+            default=20,
+            help='Number of synthetic users (fewer users - more races)'),
+        make_option('--processes',
+            type='int',
+            dest='processes',
+            default=2,
+            help='Number of processes'),
+        make_option('--threads',
+            type='int',
+            dest='threads',
+            default=8,
+            help='Number of threads per process'),
+        make_option('--operations',
+            type='int',
+            dest='operations',
+            default=200,
+            help='Operations per thread'),
+        make_option('--seed',
+            type='int',
+            dest='seed',
+            default=0,
+            help='Seed of random operations'),
+        make_option('--force',
+            action='store_true',
+            dest='force',
+            default=False,
+            help='Run even with DEBUG = False'),
+    )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("Refusing to load a production database, "
+                               "set DEBUG = True or pass --force")
+        if options['users'] < 2:
+            raise CommandError("At least 2 users are required")
+
+        user_pks = create_users(options['users'])
+        try:
+            self.run(user_pks, options)
+        finally:
+            delete_users(user_pks)
+
+    def run(self, user_pks, options):
+        tasks = [(user_pks, options['threads'], options['operations'],
+                  options['seed'] + i * options['threads'])
+                 for i in range(options['processes'])]
+        stats = Stats()
+
+        started = time.time()
+        pool = Pool(options['processes'], initializer=init_worker)
+        try:
+            for operations in pool.imap_unordered(run_process, tasks):
+                stats.merge(operations)
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = time.time() - started
+
+        self.stdout.write("%-20s %8s %8s %8s %10s" % (
+            'operation', 'count', 'refused', 'errors', 'avg, ms'))
+        total = errors = 0
+        for name, op in sorted(stats.operations.items()):
+            op_errors = sum(op['errors'].values())
+            total += op['count']
+            errors += op_errors
+            self.stdout.write("%-20s %8d %8d %8d %10.2f" % (
+                name, op['count'], op['refused'], op_errors,
+                op['elapsed'] * 1000 / op['count']))
+            for kind, count in sorted(op['errors'].items()):
+                self.stdout.write("    %s: %d" % (kind, count))
+
+        self.stdout.write("%d operations in %.2fs (%.1f ops/s), %d errors" % (
+            total, elapsed, total / elapsed if elapsed else float(total), errors))
+
+        violations = check_invariants(user_pks)
+        for name, count in sorted(violations.items()):
+            self.stdout.write("%s: %d" % (name, count))
+        if any(violations.values()):
+            self.stderr.write("Invariants violated")
@@ -0,0 +1,100 @@
+import threading
+import time
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from friendship.compat import get_user_model
+from friendship.models import warm_caches
+from friendship.utils import chunked
+
+
+class Throttle(object):
+    """ Spaces out work so that no more than `rate` users per second pass """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = time.time()
+
+    def wait(self, count):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_at)
+            self.next_at = start + count * self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+
+class Command(BaseCommand):
+    help = "Warm relationship caches of recently active users"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days',
+            type='int',
+            dest='days',
+            default=7,
+            help='Warm users logged in within the last N days'),
+        make_option('--limit',
+            type='int',
+            dest='limit',
+            default=0,
+            help='Warm at most N users, most recently active first'),
+        make_option('--workers',
+            type='int',
+            dest='workers',
+            default=4,
+            help='Number of threads'),
+        make_option('--chunk-size',
+            type='int',
+            dest='chunk_size',
+            default=100,
+            help='Users warmed per batch of queries'),
+        make_option('--rate',
+            type='float',
+            dest='rate',
+            default=0,
+            help='Max users warmed per second (0 - unlimited)'),
+    )
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        users = get_user_model().objects.filter(last_login__gte=since)\
+            .order_by('-last_login').only('id').as_pymongo()
+        if options['limit']:
+            users = users.limit(options['limit'])
+        user_pks = [u['_id'] for u in users]
+
+        throttle = Throttle(options['rate'])
+        verbose = int(options['verbosity']) > 1
+
+        def warm(chunk):
+            throttle.wait(len(chunk))
+            return len(chunk), warm_caches(chunk)
+
+        started = time.time()
+        warmed_users = warmed_keys = 0
+        pool = ThreadPool(options['workers'])
+        try:
+            for users_count, keys_count in pool.imap_unordered(
+                    warm, chunked(user_pks, options['chunk_size'])):
+                warmed_users += users_count
+                warmed_keys += keys_count
+                if verbose:
+                    self.stdout.write("%d/%d users warmed" % (warmed_users, len(user_pks)))
+        finally:
+            pool.close()
+            pool.join()
+
+        elapsed = time.time() - started
+        self.stdout.write(
+            "%d keys of %d users warmed in %.2fs (%.1f users/s)" % (
+                warmed_keys, warmed_users, elapsed,
+                warmed_users / elapsed if elapsed else float(warmed_users)))
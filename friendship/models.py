@@ -1,27 +1,56 @@
 from __future__ import unicode_literals
 
+import hashlib
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
 from django.conf import settings
-from django.core.cache import cache
 from django.core.exceptions import ValidationError
 
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 
-from mongoengine import fields, signals, Document
+from mongoengine import fields, register_connection, Document
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
 from mongoengine.queryset import Q, QuerySet
-
-from friendship.settings import (USE_NOTIFICATION_APP,
-    NOTIFY_ABOUT_NEW_FRIENDS_OF_FRIEND, NOTIFY_ABOUT_FRIENDS_REMOVAL)
-from friendship.compat import get_user_model
-from friendship.exceptions import AlreadyExistsError
+from pymongo import ReadPreference
+
+from friendship.settings import (USE_NOTIFICATION_APP, NOTIFIER,
+    QUERY_BATCH_SIZE, SEPARATION_MAX_NODES, SEPARATION_CACHE_TIMEOUT,
+    STREAM_BATCH_SIZE, REJECTED_REQUEST_TTL, RATE_LIMITS, DB_ALIAS,
+    DB_CONNECTION, CACHE_READ_PREFERENCE, CACHE_MAX_STALENESS,
+    PREFETCH_ON_LOGIN, CACHE_SERIALIZER, CACHE_ALIAS, CACHE_KEY_PREFIX,
+    CACHE_TIMEOUTS, CACHE_TIMEOUT_JITTER, CACHE_MAX_ITEMS,
+    REQUEST_COUNT_TIMEOUT, RECENT_CACHE_SIZE, USE_SUMMARY, SUMMARY_SIZE,
+    SUMMARY_MAX_AGE,
+    SHARDING, INBOX_SIZE, INBOX_SENDER_FIELDS, HOT_ACCOUNT_FOLLOWERS,
+    FOLLOWER_PAGE_SIZE, FOLLOWER_PAGE_TIMEOUT)
+from friendship.compat import (get_user_model, get_read_preference,
+    import_string, CacheProxy)
+from friendship.exceptions import AlreadyExistsError, RateLimitExceeded
 from friendship.signals import (friendship_request_created, \
     friendship_request_rejected, friendship_request_canceled, \
     friendship_request_viewed, friendship_request_accepted, \
     friendship_removed, inspirations_created, inspirationals_created,
     inspirations_removed, inspirationals_removed, blocking_created,
-    blocking_removed)
+    blocking_removed, friendship_batch_flushed)
+from friendship.outbox import record_event
+from friendship.utils import chunked, split_id_ranges
+
+
 
+if DB_CONNECTION is not None:
+    register_connection(DB_ALIAS, **DB_CONNECTION)
+
+if CACHE_READ_PREFERENCE != 'primary':
+    REFILL_READ_PREFERENCE = get_read_preference(
+        CACHE_READ_PREFERENCE, CACHE_MAX_STALENESS)
+else:
+    REFILL_READ_PREFERENCE = None
 
 
 CACHE_TYPES = {
@@ -37,23 +66,47 @@ CACHE_TYPES = {
     'unrejected_requests': 'frur-%s',
     'unrejected_request_count': 'frurc-%s',
     'blocked': 'bl-%s',
+    'separation': 'fsp-%s',
+    'rate_limit': 'frl-%s',
+    'blocked_by': 'blb-%s',
+    'tagged_friends': 'ft-%s',
+    'friend_tags_version': 'ftv-%s',
+    'separation_version': 'fsv-%s',
+    'recent_friends': 'frf-%s',
+    'new_followers': 'ifn-%s',
+    'summary': 'fsum-%s',
+    'inbox': 'fri-%s',
+    'unread_inbox': 'friu-%s',
+    'unrejected_inbox': 'friur-%s',
+    'follower_count': 'ifc-%s',
+    'follower_page': 'ifp-%s',
 }
 
 BUST_CACHES = {
-    'friends': ['friends'],
-    'inspirations': ['inspirations'],
+    'friends': ['friends', 'friend_tags_version', 'recent_friends',
+                'separation_version'],
+    'friend_tags': ['friend_tags_version'],
+    'inspirations': ['inspirations', 'new_followers'],
     'inspirationals': ['inspirationals'],
     'requests': [
         'requests',
         'unread_requests',
-        'unread_request_count',
         'read_requests',
         'rejected_requests',
         'unrejected_requests',
+        'inbox',
+        'unread_inbox',
+        'unrejected_inbox',
+    ],
+    # counters are adjusted in place, see `counter_incr`
+    'request_counts': [
+        'unread_request_count',
         'unrejected_request_count',
     ],
     'sent_requests': ['sent_requests'],
     'blocked': ['blocked'],
+    'blocked_by': ['blocked_by'],
+    'summary': ['summary'],
 }
 
 
@@ -61,16 +114,369 @@ def cache_key(kind, user_pk):
     """
     Build the cache key for a particular kind of cached value
     """
-    return CACHE_TYPES[kind] % user_pk
+    return CACHE_KEY_PREFIX + CACHE_TYPES[kind] % user_pk
+
+
+cache = CacheProxy(CACHE_ALIAS)
+serializer = import_string(CACHE_SERIALIZER)()
+
+
+def cache_timeout(kind, timeout=None):
+    """
+    Return the timeout of a given kind, randomly extended by
+    FRIENDSHIP_CACHE_TIMEOUT_JITTER so keys don't expire in waves
+    """
+    if timeout is None:
+        timeout = CACHE_TIMEOUTS.get(kind, cache.default_timeout)
+    if timeout and CACHE_TIMEOUT_JITTER:
+        timeout = int(timeout * (1 + random.uniform(0, CACHE_TIMEOUT_JITTER)))
+    return timeout
+
+
+def is_cacheable(value):
+    """ Lists longer than FRIENDSHIP_CACHE_MAX_ITEMS aren't cached """
+    return (CACHE_MAX_ITEMS is None or
+            not isinstance(value, (list, tuple)) or
+            len(value) <= CACHE_MAX_ITEMS)
+
+
+def cache_get(kind, user_pk):
+    """
+    Return the cached value of a given kind or None
+    """
+    data = cache.get(cache_key(kind, user_pk))
+    if data is None:
+        return None
+    return serializer.loads(data)
+
+
+def cache_get_many(items):
+    """
+    Return {(kind, user_pk): value} of cached values for given
+    (kind, user_pk) pairs, with a single round trip
+    """
+    keys = dict((cache_key(kind, pk), (kind, pk)) for kind, pk in items)
+    values = {}
+    for key, data in cache.get_many(list(keys)).items():
+        value = serializer.loads(data)
+        if value is not None:
+            values[keys[key]] = value
+    return values
+
+
+def cache_set(kind, user_pk, value, timeout=None):
+    """
+    Cache the value of a given kind, see `cache_timeout`
+    and `is_cacheable`
+    """
+    if is_cacheable(value):
+        cache.set(cache_key(kind, user_pk), serializer.dumps(value),
+                  cache_timeout(kind, timeout))
+
+
+# `cache_set_many` spreads keys of a kind over this many jittered timeouts
+TIMEOUT_BUCKETS = 4
+
+
+def cache_set_many(values):
+    """
+    Cache {(kind, user_pk): value} with a round trip per timeout: keys
+    of every kind are randomly spread over TIMEOUT_BUCKETS jittered
+    timeouts, so keys cached together don't expire together
+    """
+    timeouts = {}
+    by_timeout = {}
+    for (kind, pk), value in values.items():
+        if not is_cacheable(value):
+            continue
+        if kind not in timeouts:
+            timeouts[kind] = [cache_timeout(kind) for _ in range(TIMEOUT_BUCKETS)]
+        timeout = random.choice(timeouts[kind])
+        by_timeout.setdefault(timeout, {})[cache_key(kind, pk)] = serializer.dumps(value)
+
+    for timeout, data in by_timeout.items():
+        cache.set_many(data, timeout)
+
+
+def counter_get(kind, user_pk):
+    """
+    Return the counter of a given kind or None. Counters are stored as
+    plain integers (not serialized), so the cache can change them atomically.
+    """
+    return cache.get(cache_key(kind, user_pk))
+
+
+def counter_get_many(kind, user_pks):
+    """ Return {user_pk: counter} of the cached counters of a given kind """
+    keys = dict((cache_key(kind, pk), pk) for pk in user_pks)
+    return dict((keys[key], value)
+                for key, value in cache.get_many(list(keys)).items())
+
+
+def counter_set(kind, user_pk, value, timeout=REQUEST_COUNT_TIMEOUT):
+    """
+    Store the counter unless it is there already, so a recount never
+    overwrites increments made meanwhile. Counters expire after `timeout`
+    (FRIENDSHIP_REQUEST_COUNT_TIMEOUT), which reconciles any drift.
+    """
+    cache.add(cache_key(kind, user_pk), value,
+              cache_timeout(kind, CACHE_TIMEOUTS.get(kind, timeout)))
+
+
+def counter_incr(kind, user_pk, delta=1):
+    """
+    Atomically adjust the counter if it is cached, missing counters are
+    recounted on the next read
+    """
+    key = cache_key(kind, user_pk)
+    try:
+        value = cache.incr(key, delta)
+    except ValueError:
+        return
+    if delta < 0 and value <= 0:
+        # memcached stops decrements at 0, so a counter that drifted below
+        # zero can't be told from a real 0; let the next read recount
+        cache.delete(key)
+
+
+def count_requests(user_pk, unread=0, unrejected=0):
+    """ Adjust request counters (and the summary) of the receiver """
+    if unread:
+        counter_incr('unread_request_count', user_pk, unread)
+    if unrejected:
+        counter_incr('unrejected_request_count', user_pk, unrejected)
+    summary_changed(user_pk, inc={
+        'unread_request_count': unread,
+        'unrejected_request_count': unrejected,
+    })
 
 
 def bust_cache(kind, user_pk):
     """
     Bust our cache for a given kind, can bust multiple caches
     """
+    bust_caches(kind, [user_pk])
+
+
+def bust_caches(kind, user_pks):
+    """
+    Bust our cache for a given kind for many users at once
+    """
     bust_keys = BUST_CACHES[kind]
-    keys = [CACHE_TYPES[k] % user_pk for k in bust_keys]
-    cache.delete_many(keys)
+    keys = [cache_key(k, pk) for pk in user_pks for k in bust_keys]
+    if not keys:
+        return
+
+    current = getattr(_batch_state, 'current', None)
+    if current is not None:
+        current.cache_keys.update(keys)
+    else:
+        cache.delete_many(keys)
+
+
+_batch_state = threading.local()
+
+
+def _dedupe_key(value):
+    if isinstance(value, Document):
+        return (value.__class__, value.pk) if value.pk else id(value)
+    return value
+
+
+class _Batch(object):
+    """ Cache keys and signals collected by `batch` """
+
+    def __init__(self):
+        self.cache_keys = set()
+        self.signals = []
+        self._seen = set()
+
+    def add_signal(self, signal, kwargs):
+        try:
+            key = (signal, tuple(sorted(
+                (name, _dedupe_key(value)) for name, value in kwargs.items())))
+            duplicate = key in self._seen
+        except TypeError:
+            # unhashable arguments, can't tell duplicates
+            key, duplicate = None, False
+
+        if duplicate:
+            return
+        if key is not None:
+            self._seen.add(key)
+        self.signals.append((signal, kwargs))
+
+    def flush(self):
+        if self.cache_keys:
+            cache.delete_many(list(self.cache_keys))
+
+        for signal, kwargs in self.signals:
+            signal.send(**kwargs)
+
+        if self.signals:
+            friendship_batch_flushed.send(sender=self.__class__, signals=self.signals)
+
+
+@contextmanager
+def batch():
+    """
+    Defer signals and cache busting until the outermost block exits.
+    Duplicated signals are sent once and all cache keys are deleted with
+    a single `delete_many`, so receivers see fresh caches.
+    """
+    current = getattr(_batch_state, 'current', None)
+    if current is not None:
+        # nested blocks join the outer one
+        yield current
+        return
+
+    current = _batch_state.current = _Batch()
+    try:
+        yield current
+    finally:
+        _batch_state.current = None
+        current.flush()
+
+
+def send_signal(signal, **kwargs):
+    """ Send signal now or, within `batch`, when the batch exits """
+    current = getattr(_batch_state, 'current', None)
+    if current is not None:
+        current.add_signal(signal, kwargs)
+    else:
+        signal.send(**kwargs)
+
+
+def owner_queries(queries):
+    """
+    Combine Q objects of the same collection into a single `$or` query,
+    unless FRIENDSHIP_SHARDING is on: then each one (keyed by its owner)
+    is queried on its own, so every query targets a single shard
+    """
+    if SHARDING or len(queries) < 2:
+        return queries
+
+    query = queries[0]
+    for other in queries[1:]:
+        query = query | other
+    return [query]
+
+
+def for_cache_refill(queryset):
+    """
+    Route a read that tolerates replication lag (`warm_caches`, id streams,
+    follower pages which are never busted) according to
+    FRIENDSHIP_CACHE_READ_PREFERENCE. Refills after a cache miss stay on
+    the primary: the miss often follows a bust, and a lagging secondary
+    would cache the old list for the whole timeout.
+    """
+    if REFILL_READ_PREFERENCE is None:
+        return queryset
+    return queryset.read_preference(REFILL_READ_PREFERENCE)
+
+
+
+def check_rate_limit(action, user_pk):
+    """
+    Count an attempt of `action` by the user and raise RateLimitExceeded
+    if there were too many of them, see FRIENDSHIP_RATE_LIMITS.
+
+    The sliding window is approximated by two fixed windows: attempts of
+    the previous one are weighted by the part of it the sliding window
+    still covers.
+    """
+    limit = RATE_LIMITS.get(action)
+    if not limit:
+        return
+
+    max_attempts, period = limit
+    now = time.time()
+    window = int(now // period)
+    key = cache_key('rate_limit', '%s-%s-%s' % (action, user_pk, window))
+
+    cache.add(key, 0, period * 2)
+    try:
+        attempts = cache.incr(key)
+    except ValueError:
+        # the counter was evicted right after being added
+        cache.set(key, 1, period * 2)
+        attempts = 1
+
+    previous = cache.get(
+        cache_key('rate_limit', '%s-%s-%s' % (action, user_pk, window - 1))) or 0
+    weight = 1 - (now % period) / float(period)
+
+    if attempts + previous * weight > max_attempts:
+        raise RateLimitExceeded(_("Too many attempts, please try again later."))
+
+
+def stream_ids(queryset, field, after=None, until=None, batch_size=None):
+    """
+    Iterate over (checkpoint, user_pk) pairs of `field` without loading
+    documents. Rows are ordered by `_id`, so passing the last seen
+    checkpoint as `after` resumes the stream.
+    """
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    if until is not None:
+        queryset = queryset.filter(id__lte=until)
+
+    queryset = for_cache_refill(queryset).only(field).order_by('id')\
+        .as_pymongo().batch_size(batch_size or STREAM_BATCH_SIZE)
+
+    for doc in queryset:
+        yield doc['_id'], doc[field]
+
+
+def naive_datetime(value):
+    """
+    Aware datetimes as naive ones, the way pymongo returns stored dates:
+    in UTC with USE_TZ, in the default time zone (`timezone.now()`)
+    otherwise. Naive datetimes are left alone.
+    """
+    if value is not None and timezone.is_aware(value):
+        return timezone.make_naive(value, timezone.utc if settings.USE_TZ
+                                   else timezone.get_default_timezone())
+    return value
+
+
+def recent_relations(kind, document, owner, user, since=None, limit=None):
+    """
+    Return `document` relationships of the user (`owner` field) newest
+    first, created since `since` and at most `limit` of them
+    (FRIENDSHIP_RECENT_CACHE_SIZE by default). The newest
+    FRIENDSHIP_RECENT_CACHE_SIZE relationships are cached, older ones
+    are queried.
+    """
+    if limit is None:
+        limit = RECENT_CACHE_SIZE
+    since = naive_datetime(since)
+
+    recent = cache_get(kind, user.pk)
+
+    if recent is None:
+        qs = document.objects.filter(**{owner: user})\
+            .order_by('-created').limit(RECENT_CACHE_SIZE).select_related(max_depth=2)
+        recent = list(qs)
+        cache_set(kind, user.pk, recent)
+
+    rels = recent
+    if since is not None:
+        rels = [rel for rel in rels
+                if rel.created and naive_datetime(rel.created) >= since]
+    if len(rels) >= limit:
+        return rels[:limit]
+
+    # the cached list covers everything unless it is full and all of it
+    # is newer than `since`
+    if len(recent) < RECENT_CACHE_SIZE or len(rels) < len(recent):
+        return rels
+
+    qs = document.objects.filter(**{owner: user})
+    if since is not None:
+        qs = qs.filter(created__gte=since)
+    qs = qs.order_by('-created').limit(limit)
+    return list(qs.select_related(max_depth=2))
 
 
 @python_2_unicode_compatible
@@ -88,6 +494,19 @@ class FriendshipRequest(Document):
     rejected = fields.DateTimeField(required=False, null=True)
     viewed = fields.DateTimeField(required=False, null=True)
 
+    meta = {
+        'db_alias': DB_ALIAS,
+        'indexes': [
+            'from_user',
+            'to_user',
+        ] + ([{
+            # let MongoDB expire rejected requests, pending ones have no
+            # `rejected` date and are never touched by the TTL monitor
+            'fields': ['rejected'],
+            'expireAfterSeconds': REJECTED_REQUEST_TTL,
+        }] if REJECTED_REQUEST_TTL else []),
+    }
+
     class Meta:
         verbose_name = _('Friendship Request')
         verbose_name_plural = _('Friendship Requests')
@@ -97,193 +516,398 @@ class FriendshipRequest(Document):
 
     def accept(self):
         """ Accept this friendship request """
-        relation1 = Friend.objects.create(
-            from_user=self.from_user,
-            to_user=self.to_user
-        )
-
-        relation2 = Friend.objects.create(
-            from_user=self.to_user,
-            to_user=self.from_user
-        )
-
-        friendship_request_accepted.send(
-            sender=self,
-            from_user=self.from_user,
-            to_user=self.to_user
-        )
-
-        self.delete()
-
-        # Delete any reverse requests
-        FriendshipRequest.objects.filter(
-            from_user=self.to_user,
-            to_user=self.from_user
-        ).delete()
-
-        # Bust requests cache - request is deleted
-        bust_cache('requests', self.to_user.pk)
-        bust_cache('sent_requests', self.from_user.pk)
-        # Bust reverse requests cache - reverse request might be deleted
-        bust_cache('requests', self.from_user.pk)
-        bust_cache('sent_requests', self.to_user.pk)
-        # Bust friends cache - new friends added
-        bust_cache('friends', self.to_user.pk)
-        bust_cache('friends', self.from_user.pk)
+        # bust both users' caches with a single delete_many
+        with batch():
+            relation1 = Friend.objects.create(
+                from_user=self.from_user,
+                to_user=self.to_user
+            )
+
+            relation2 = Friend.objects.create(
+                from_user=self.to_user,
+                to_user=self.from_user
+            )
+
+            record_event('friendship_request_accepted', self.from_user, self.to_user,
+                         request=self.pk)
+
+            send_signal(
+                friendship_request_accepted,
+                sender=self,
+                from_user=self.from_user,
+                to_user=self.to_user
+            )
+
+            if self._delete():
+                self._discount()
+
+            # Delete any reverse requests
+            reverse_deleted = FriendshipRequest.objects.filter(
+                from_user=self.to_user,
+                to_user=self.from_user
+            ).delete()
+            if reverse_deleted:
+                # their state is unknown, let the counters be recounted
+                bust_cache('request_counts', self.from_user.pk)
+                invalidate_summaries([self.from_user.pk])
+
+            # Bust requests cache - request is deleted
+            bust_cache('requests', self.to_user.pk)
+            bust_cache('sent_requests', self.from_user.pk)
+            # Bust reverse requests cache - reverse request might be deleted
+            bust_cache('requests', self.from_user.pk)
+            bust_cache('sent_requests', self.to_user.pk)
+            # Bust friends cache - new friends added
+            bust_cache('friends', self.to_user.pk)
+            bust_cache('friends', self.from_user.pk)
+            summary_changed(self.from_user.pk, inc={'friends_count': 1},
+                            push={'friend_ids': self.to_user.pk})
+            summary_changed(self.to_user.pk, inc={'friends_count': 1},
+                            push={'friend_ids': self.from_user.pk})
 
         return True
 
     def reject(self):
         """ reject this friendship request """
+        was_rejected = self.rejected is not None
         self.rejected = timezone.now()
         self.save()
-        friendship_request_rejected.send(sender=self)
+        if not was_rejected:
+            count_requests(self.to_user.pk, unrejected=-1)
+        record_event('friendship_request_rejected', self.from_user, self.to_user,
+                     request=self.pk)
+        send_signal(friendship_request_rejected, sender=self)
         bust_cache('requests', self.to_user.pk)
 
     def cancel(self):
         """ cancel this friendship request """
-        self.delete()
-        friendship_request_canceled.send(sender=self)
+        if self._delete():
+            self._discount()
+        record_event('friendship_request_canceled', self.from_user, self.to_user,
+                     request=self.pk)
+        send_signal(friendship_request_canceled, sender=self)
         bust_cache('requests', self.to_user.pk)
         bust_cache('sent_requests', self.from_user.pk)
         return True
 
     def mark_viewed(self):
+        was_viewed = self.viewed is not None
         self.viewed = timezone.now()
-        friendship_request_viewed.send(sender=self)
+        send_signal(friendship_request_viewed, sender=self)
         self.save()
+        if not was_viewed:
+            count_requests(self.to_user.pk, unread=-1)
+        record_event('friendship_request_viewed', self.from_user, self.to_user,
+                     request=self.pk)
         bust_cache('requests', self.to_user.pk)
         return True
 
+    def _delete(self):
+        """
+        Delete the request, return whether it was still stored, so a
+        request accepted or canceled twice is discounted once
+        """
+        return FriendshipRequest.objects.filter(pk=self.pk).delete() > 0
+
+    def _discount(self):
+        """ Take the deleted request out of the receiver's counters """
+        count_requests(self.to_user.pk,
+                       unread=-1 if self.viewed is None else 0,
+                       unrejected=-1 if self.rejected is None else 0)
+
 
 class FriendshipQuerySet(QuerySet):
     """ Friendship manager """
 
-    def friends(self, user):
-        """ Return a list of all friends """
-        key = cache_key('friends', user.pk)
-        friends = cache.get(key)
+    def friends(self, user, tag=None):
+        """ Return a list of all friends or of those tagged with `tag` """
+        if tag is not None:
+            return self._tagged_friends(user, tag)
+
+        friends = cache_get('friends', user.pk)
 
         if friends is None:
-            qs = Friend.objects.filter(from_user=user).select_related(max_depth=2)
+            qs = Friend.objects.filter(from_user=user)\
+                .select_related(max_depth=2)
             friends = [u.to_user for u in qs]
-            cache.set(key, friends)
+            cache_set('friends', user.pk, friends)
 
         return friends
 
+    def recent_friends(self, user, since=None, limit=None):
+        """
+        Return friends newest first, optionally only those befriended
+        since a datetime, at most `limit` (FRIENDSHIP_RECENT_CACHE_SIZE)
+        of them
+        """
+        rels = recent_relations('recent_friends', Friend, 'from_user', user,
+                                since=since, limit=limit)
+        return [rel.to_user for rel in rels]
+
+    def _tagged_friends(self, user, tag):
+        # tagged lists are cached under the current tags version of the
+        # user, busting the version drops all of them at once
+        version = cache_get('friend_tags_version', user.pk)
+        if version is None:
+            version = random.randint(0, 2 ** 31)
+            cache_set('friend_tags_version', user.pk, version)
+
+        key = '%s-%s-%s' % (user.pk, version,
+                            hashlib.md5(tag.encode('utf-8')).hexdigest())
+        friends = cache_get('tagged_friends', key)
+
+        if friends is None:
+            qs = Friend.objects.filter(from_user=user, tags=tag)\
+                .select_related(max_depth=2)
+            friends = [u.to_user for u in qs]
+            cache_set('tagged_friends', key, friends)
+
+        return friends
+
+    def tag_friends(self, user, friends, tag):
+        """
+        Tag user's friendships with given friends (e.g. 'close friends'),
+        return the number of tagged friendships
+        """
+        if not tag:
+            raise ValidationError(_("Tag cannot be empty"))
+
+        updated = Friend.objects.filter(
+            from_user=user,
+            to_user__in=[f.pk for f in friends]
+        ).update(add_to_set__tags=tag)
+
+        bust_cache('friend_tags', user.pk)
+        return updated
+
+    def untag_friends(self, user, tag, friends=None):
+        """
+        Remove tag from user's friendships with given friends (or with
+        everybody), return the number of untagged friendships
+        """
+        qs = Friend.objects.filter(from_user=user, tags=tag)
+        if friends is not None:
+            qs = qs.filter(to_user__in=[f.pk for f in friends])
+
+        updated = qs.update(pull__tags=tag)
+
+        bust_cache('friend_tags', user.pk)
+        return updated
+
     def requests(self, user):
         """ Return a list of friendship requests """
-        key = cache_key('requests', user.pk)
-        requests = cache.get(key)
+        requests = cache_get('requests', user.pk)
 
         if requests is None:
             qs = FriendshipRequest.objects.filter(
                 to_user=user).select_related(max_depth=2)
             requests = list(qs)
-            cache.set(key, requests)
+            cache_set('requests', user.pk, requests)
+
+        return requests
+
+    # filters of `inbox` states
+    INBOX_STATES = {
+        None: ('inbox', {}),
+        'unread': ('unread_inbox', {'viewed': None}),
+        'unrejected': ('unrejected_inbox', {'rejected': None}),
+    }
 
+    def inbox(self, user, state=None, limit=None):
+        """
+        Return the newest received requests (all, 'unread' or 'unrejected')
+        as plain dicts with an embedded summary of the sender, loaded by
+        a single `$lookup` aggregation (MongoDB 3.2+), or by a second `$in`
+        query when users live in another database (FRIENDSHIP_DB_ALIAS).
+        The newest FRIENDSHIP_INBOX_SIZE requests are cached as they are,
+        larger limits are always loaded.
+        """
+        kind, match = self.INBOX_STATES[state]
+        limit = limit or INBOX_SIZE
+        if limit > INBOX_SIZE:
+            return self._load_inbox(user, match, limit)
+
+        requests = cache_get(kind, user.pk)
+
+        if requests is None:
+            requests = self._load_inbox(user, match, INBOX_SIZE)
+            cache_set(kind, user.pk, requests)
+
+        return requests[:limit]
+
+    def _load_inbox(self, user, match, limit):
+        User = get_user_model()
+        sender_fields = dict(
+            [('_id', 1)] + [(field, 1) for field in INBOX_SENDER_FIELDS])
+        # `$lookup` only joins collections of the same database
+        lookup = (User._meta.get('db_alias') or DEFAULT_CONNECTION_NAME) == DB_ALIAS
+
+        match = dict(match, to_user=user.pk)
+        pipeline = [
+            {'$match': match},
+            {'$sort': {'created': -1}},
+            {'$limit': limit},
+        ]
+        projection = dict((field, 1) for field in (
+            'from_user', 'message', 'created', 'viewed', 'rejected'))
+        if lookup:
+            pipeline.append({'$lookup': {
+                'from': User._get_collection_name(),
+                'localField': 'from_user',
+                'foreignField': '_id',
+                'as': 'sender',
+            }})
+            projection.update(
+                ('sender.%s' % field, 1) for field in sender_fields)
+        pipeline.append({'$project': projection})
+
+        result = FriendshipRequest._get_collection().aggregate(pipeline)
+        if isinstance(result, dict):
+            # pymongo < 3
+            result = result['result']
+        docs = list(result)
+
+        if not lookup and docs:
+            senders = dict(
+                (sender['_id'], sender) for sender in User._get_collection().find(
+                    {'_id': {'$in': list(set(doc['from_user'] for doc in docs))}},
+                    sender_fields))
+            for doc in docs:
+                sender = senders.get(doc['from_user'])
+                doc['sender'] = [sender] if sender else []
+
+        requests = []
+        for doc in docs:
+            if not doc['sender']:
+                # sent by a deleted user
+                continue
+            sender = doc['sender'][0]
+            summary = dict((field, sender[field])
+                           for field in INBOX_SENDER_FIELDS if field in sender)
+            summary['id'] = sender['_id']
+            summary['display_name'] = self._display_name(User._from_son(sender))
+            requests.append({
+                'id': doc['_id'],
+                'message': doc.get('message', ''),
+                'created': doc.get('created'),
+                'viewed': doc.get('viewed'),
+                'rejected': doc.get('rejected'),
+                'from_user': summary,
+            })
         return requests
 
+    def _display_name(self, user):
+        if hasattr(user, 'get_display_name'):
+            return user.get_display_name()
+        return '%s' % user
+
     def sent_requests(self, user):
         """ Return a list of friendship requests from user """
-        key = cache_key('sent_requests', user.pk)
-        requests = cache.get(key)
+        requests = cache_get('sent_requests', user.pk)
 
         if requests is None:
             qs = FriendshipRequest.objects.filter(
                 from_user=user).select_related(max_depth=2)
             requests = list(qs)
-            cache.set(key, requests)
+            cache_set('sent_requests', user.pk, requests)
 
         return requests
 
     def unread_requests(self, user):
         """ Return a list of unread friendship requests """
-        key = cache_key('unread_requests', user.pk)
-        unread_requests = cache.get(key)
+        unread_requests = cache_get('unread_requests', user.pk)
 
         if unread_requests is None:
             qs = FriendshipRequest.objects.filter(
                 to_user=user,
                 viewed=None).select_related(max_depth=2)
             unread_requests = list(qs)
-            cache.set(key, unread_requests)
+            cache_set('unread_requests', user.pk, unread_requests)
 
         return unread_requests
 
     def unread_request_count(self, user):
         """ Return a count of unread friendship requests """
-        key = cache_key('unread_request_count', user.pk)
-        count = cache.get(key)
+        count = counter_get('unread_request_count', user.pk)
 
         if count is None:
+            # counted on the primary, a lagging count would be adjusted
+            # by increments until it expires
             count = FriendshipRequest.objects.filter(
                 to_user=user,
                 viewed=None).count()
-            cache.set(key, count)
+            counter_set('unread_request_count', user.pk, count)
 
         return count
 
     def read_requests(self, user):
         """ Return a list of read friendship requests """
-        key = cache_key('read_requests', user.pk)
-        read_requests = cache.get(key)
+        read_requests = cache_get('read_requests', user.pk)
 
         if read_requests is None:
             qs = FriendshipRequest.objects.filter(
                 to_user=user,
                 viewed__ne=None).select_related(max_depth=2)
             read_requests = list(qs)
-            cache.set(key, read_requests)
+            cache_set('read_requests', user.pk, read_requests)
 
         return read_requests
 
     def rejected_requests(self, user):
         """ Return a list of rejected friendship requests """
-        key = cache_key('rejected_requests', user.pk)
-        rejected_requests = cache.get(key)
+        rejected_requests = cache_get('rejected_requests', user.pk)
 
         if rejected_requests is None:
             qs = FriendshipRequest.objects.filter(
                 to_user=user,
                 rejected__ne=None).select_related(max_depth=2)
             rejected_requests = list(qs)
-            cache.set(key, rejected_requests)
+            cache_set('rejected_requests', user.pk, rejected_requests)
 
         return rejected_requests
 
     def unrejected_requests(self, user):
         """ All requests that haven't been rejected """
-        key = cache_key('unrejected_requests', user.pk)
-        unrejected_requests = cache.get(key)
+        unrejected_requests = cache_get('unrejected_requests', user.pk)
 
         if unrejected_requests is None:
             qs = FriendshipRequest.objects.filter(
                 to_user=user,
                 rejected=None).select_related(max_depth=2)
             unrejected_requests = list(qs)
-            cache.set(key, unrejected_requests)
+            cache_set('unrejected_requests', user.pk, unrejected_requests)
 
         return unrejected_requests
 
     def unrejected_request_count(self, user):
         """ Return a count of unrejected friendship requests """
-        key = cache_key('unrejected_request_count', user.pk)
-        count = cache.get(key)
+        count = counter_get('unrejected_request_count', user.pk)
 
         if count is None:
             count = FriendshipRequest.objects.filter(
                 to_user=user,
                 rejected=None).count()
-            cache.set(key, count)
+            counter_set('unrejected_request_count', user.pk, count)
 
         return count
 
+    def reconcile_request_counts(self, user):
+        """
+        Recount request counters of the user from MongoDB, e.g. after
+        requests were changed behind the managers' back
+        """
+        bust_cache('request_counts', user.pk)
+        invalidate_summaries([user.pk])
+        return (self.unread_request_count(user),
+                self.unrejected_request_count(user))
+
     def add_friend(self, from_user, to_user, message=None):
         """ Create a friendship request """
         if from_user == to_user:
             raise ValidationError(_("Users cannot be friends with themselves"))
 
+        check_rate_limit('add_friend', from_user.pk)
+
         blocked = Blocking.objects.is_blocked(from_user=to_user, to_user=from_user)
         if blocked:
             raise ValidationError(
@@ -311,51 +935,116 @@ class FriendshipQuerySet(QuerySet):
         if request is None:
             request = FriendshipRequest.objects(
                 from_user=from_user,
-                to_user=to_user).first()
+                to_user=to_user).read_preference(ReadPreference.PRIMARY).first()
+            count_requests(to_user.pk, unread=1, unrejected=1)
         else:
+            # the request is renewed, `request` holds its previous state
+            count_requests(to_user.pk,
+                           unread=1 if request.viewed is not None else 0,
+                           unrejected=1 if request.rejected is not None else 0)
             request.rejected = None
             request.viewed = None
             request.save()
 
+        record_event('friendship_request_created', from_user, to_user,
+                     request=request.pk)
+
         bust_cache('requests', to_user.pk)
         bust_cache('sent_requests', from_user.pk)
-        friendship_request_created.send(sender=request)
+        send_signal(friendship_request_created, sender=request)
 
         return request
 
     def remove_friend(self, to_user, from_user):
         """ Destroy a friendship relationship """
-        try:
-            qs = Friend.objects.filter(
-                Q(to_user=to_user, from_user=from_user) |
-                Q(to_user=from_user, from_user=to_user)
-            )
+        # each direction is deleted on its own, so a broken friendship
+        # (a single edge) is reported in the direction that existed
+        edges = [(edge_from, edge_to)
+                 for edge_from, edge_to in [(from_user, to_user), (to_user, from_user)]
+                 if Friend.objects.filter(from_user=edge_from, to_user=edge_to).delete()]
 
-            if qs:
-                for qs_ in list(qs):
-                    kw = {'from_user': None, 'to_user': None}
-                    if qs_.from_user == from_user:
-                        kw = {'from_user': from_user, 'to_user': to_user}
-                    elif qs_.from_user == to_user:
-                        kw = {'from_user': to_user, 'to_user': from_user}
-                    else:
-                        raise ValueError('None of from_user and to_user found in queryset.')
-
-                    kw['sender'] = qs_
-                    friendship_removed.send(**kw)
-                qs.delete()
-                bust_cache('friends', to_user.pk)
-                bust_cache('friends', from_user.pk)
-                return True
-            else:
-                return False
-        except Friend.DoesNotExist:
+        if not edges:
             return False
 
+        with batch():
+            for edge_from, edge_to in edges:
+                self._friendship_removed(edge_from, edge_to)
+            bust_cache('friends', to_user.pk)
+            bust_cache('friends', from_user.pk)
+        return True
+
+    def remove_all_friends(self, user):
+        """
+        Destroy all friendships of the user (e.g. on account deletion),
+        return the number of removed friends
+        """
+        def read(qs):
+            return [(edge['_id'], edge['from_user'], edge['to_user'])
+                    for edge in qs.only('from_user', 'to_user').as_pymongo()]
+
+        if SHARDING:
+            # edges to the user are owned by the friends, each of them is
+            # read by its owner so no query is broadcast to all shards;
+            # reverse edges of broken friendships stay for check_friendship_graph
+            edges = read(Friend.objects.filter(from_user=user))
+            for _, _, friend_pk in list(edges):
+                edges += read(Friend.objects.filter(from_user=friend_pk, to_user=user))
+        else:
+            edges = read(Friend.objects.filter(Q(from_user=user) | Q(to_user=user)))
+        if not edges:
+            return 0
+
+        # delete exactly what was read, friendships created meanwhile stay
+        if SHARDING:
+            owned = {}
+            for edge_id, edge_from, _ in edges:
+                owned.setdefault(edge_from, []).append(edge_id)
+            for owner, edge_ids in owned.items():
+                for chunk in chunked(edge_ids, QUERY_BATCH_SIZE):
+                    Friend.objects.filter(from_user=owner, id__in=chunk).delete()
+        else:
+            for chunk in chunked(edges, QUERY_BATCH_SIZE):
+                Friend.objects.filter(
+                    id__in=[edge_id for edge_id, _, _ in chunk]).delete()
+
+        friend_pks = set(edge_to if edge_from == user.pk else edge_from
+                         for _, edge_from, edge_to in edges)
+        friends = get_user_model().objects.in_bulk(list(friend_pks))
+
+        with batch():
+            for _, edge_from, edge_to in edges:
+                if edge_from == user.pk:
+                    friend = friends.get(edge_to)
+                    edge = (user, friend)
+                else:
+                    friend = friends.get(edge_from)
+                    edge = (friend, user)
+                # edges pointing to deleted users have nobody to notify
+                if friend is not None:
+                    self._friendship_removed(*edge)
+
+            bust_cache('friends', user.pk)
+            bust_caches('friends', friend_pks)
+            # some edges may point to deleted users
+            invalidate_summaries([user.pk])
+
+        return len(friend_pks)
+
+    def _friendship_removed(self, from_user, to_user):
+        record_event('friendship_removed', from_user, to_user)
+        summary_changed(from_user.pk, inc={'friends_count': -1},
+                        pull={'friend_ids': to_user.pk})
+        # the edge is already gone, the sender is rebuilt from known users
+        send_signal(
+            friendship_removed,
+            sender=Friend(from_user=from_user, to_user=to_user),
+            from_user=from_user,
+            to_user=to_user)
+
     def are_friends(self, user1, user2):
         """ Are these two users friends? """
-        friends1 = cache.get(cache_key('friends', user1.pk))
-        friends2 = cache.get(cache_key('friends', user2.pk))
+        friends1 = cache_get('friends', user1.pk)
+        friends2 = cache_get('friends', user2.pk)
         if friends1 and user2 in friends1:
             return True
         elif friends2 and user1 in friends2:
@@ -367,6 +1056,154 @@ class FriendshipQuerySet(QuerySet):
             except Friend.DoesNotExist:
                 return False
 
+    def iter_friend_ids(self, user, after=None, until=None, batch_size=None):
+        """
+        Stream (checkpoint, friend_pk) pairs of user's friends,
+        see `stream_ids`
+        """
+        return stream_ids(Friend.objects.filter(from_user=user), 'to_user',
+                          after=after, until=until, batch_size=batch_size)
+
+    def friend_id_ranges(self, user, parts):
+        """
+        Split user's friends into disjoint (after, until) ranges
+        to be consumed by `iter_friend_ids` in parallel
+        """
+        return split_id_ranges(Friend.objects.filter(from_user=user), parts)
+
+    def degree_of_separation(self, user1, user2, max_depth=3):
+        """
+        Return the number of friendship hops between two users
+        (0 - same user, 1 - friends, 2 - friends of friends, ...)
+        or None if they aren't connected within `max_depth` hops
+        """
+        path = self._connection_path_ids(user1.pk, user2.pk, max_depth)
+        if not path:
+            return None
+        return len(path) - 1
+
+    def connection_path(self, user1, user2, max_depth=3):
+        """
+        Return the shortest chain of users connecting user1 with user2
+        (both included) or an empty list if there is no such chain
+        within `max_depth` hops
+        """
+        path = self._connection_path_ids(user1.pk, user2.pk, max_depth)
+        if not path:
+            return []
+
+        users = get_user_model().objects.in_bulk(path)
+        return [users[pk] for pk in path if pk in users]
+
+    def _connection_path_ids(self, pk1, pk2, max_depth):
+        """ Cached bidirectional BFS over Friend edges """
+        if pk1 == pk2:
+            return [pk1]
+
+        # the path is symmetric, so both directions share a cache entry
+        reverse = str(pk1) > str(pk2)
+        if reverse:
+            pk1, pk2 = pk2, pk1
+
+        # paths are cached under the current versions of both users, any
+        # change of their friends drops them; changes further along the
+        # path wait for FRIENDSHIP_SEPARATION_CACHE_TIMEOUT
+        versions = cache_get_many([('separation_version', pk1), ('separation_version', pk2)])
+        missing = {}
+        for pk in (pk1, pk2):
+            if ('separation_version', pk) not in versions:
+                missing[('separation_version', pk)] = random.randint(0, 2 ** 31)
+        if missing:
+            cache_set_many(missing)
+            versions.update(missing)
+
+        pair = '%s-%s-%s-%s-%s' % (pk1, pk2, max_depth,
+                                   versions[('separation_version', pk1)],
+                                   versions[('separation_version', pk2)])
+        path = cache_get('separation', pair)
+
+        if path is None:
+            path = self._bidirectional_search(pk1, pk2, max_depth) or []
+            cache_set('separation', pair, path, SEPARATION_CACHE_TIMEOUT)
+
+        if reverse:
+            path = path[::-1]
+        return path
+
+    def _bidirectional_search(self, source, target, max_depth):
+        """
+        Expand the smaller frontier one level at a time until both
+        searches meet, giving up after SEPARATION_MAX_NODES visited users
+        """
+        parents = {source: {source: None}, target: {target: None}}
+        frontiers = {source: [source], target: [target]}
+        visited = 2
+
+        for _ in range(max_depth):
+            if not frontiers[source] or not frontiers[target]:
+                return None
+
+            if len(frontiers[source]) <= len(frontiers[target]):
+                side, other = source, target
+            else:
+                side, other = target, source
+
+            adjacency = self._friend_ids_map(frontiers[side])
+            next_frontier = []
+
+            for node in frontiers[side]:
+                for neighbour in adjacency.get(node, ()):
+                    if neighbour in parents[side]:
+                        continue
+
+                    parents[side][neighbour] = node
+                    if neighbour in parents[other]:
+                        return self._join_path(
+                            neighbour, parents[source], parents[target])
+
+                    visited += 1
+                    if visited > SEPARATION_MAX_NODES:
+                        return None
+                    next_frontier.append(neighbour)
+
+            frontiers[side] = next_frontier
+
+        return None
+
+    def _join_path(self, meeting, source_parents, target_parents):
+        path = []
+        node = meeting
+        while node is not None:
+            path.append(node)
+            node = source_parents[node]
+        path.reverse()
+
+        node = target_parents[meeting]
+        while node is not None:
+            path.append(node)
+            node = target_parents[node]
+        return path
+
+    def _friend_ids_map(self, user_pks):
+        """
+        Return {user_pk: [friend_pk, ...]} for given users, taking cached
+        friend lists when available and loading the rest with `$in` queries
+        """
+        cached = cache_get_many(('friends', pk) for pk in user_pks)
+        adjacency = {}
+
+        for (_, pk), friends in cached.items():
+            adjacency[pk] = [u.pk for u in friends]
+
+        missing = [pk for pk in user_pks if pk not in adjacency]
+        for chunk in chunked(missing, QUERY_BATCH_SIZE):
+            qs = Friend.objects.filter(from_user__in=chunk)\
+                .only('from_user', 'to_user').as_pymongo()
+            for edge in qs:
+                adjacency.setdefault(edge['from_user'], []).append(edge['to_user'])
+
+        return adjacency
+
 
 @python_2_unicode_compatible
 class Friend(Document):
@@ -376,17 +1213,26 @@ class Friend(Document):
     Important! Please note, that (from_user=User1, to_user=User2)
         and (from_user=User2, to_user=User1) are not the same!
     """
-    from_user = fields.ReferenceField(get_user_model())
-    to_user = fields.ReferenceField(get_user_model(), unique_with='from_user')
+    # sharded collections only allow unique indexes prefixed by the shard key
+    from_user = fields.ReferenceField(get_user_model(),
+                                      unique_with='to_user' if SHARDING else None)
+    to_user = fields.ReferenceField(get_user_model(),
+                                    unique_with=None if SHARDING else 'from_user')
     created = fields.DateTimeField(default=timezone.now, null=True)
-    #tags = fields.ListField(fields.StringField(), required=False)
+    tags = fields.ListField(fields.StringField(), required=False)
 
     meta = {
         'indexes': [
             'to_user',
             'from_user',
             ('from_user', 'to_user'),
+            ('from_user', 'tags'),
+            ('from_user', '-created'),
+            # `iter_friend_ids` and `friend_id_ranges` walk friends by `_id`
+            ('from_user', 'id'),
         ],
+        'shard_key': ('from_user',) if SHARDING else (),
+        'db_alias': DB_ALIAS,
         'queryset_class': FriendshipQuerySet
     }
 
@@ -408,26 +1254,122 @@ class InspirationQuerySet(QuerySet):
     """ Inspiration manager """
 
     def inspired_by_user(self, user):
-        """ Return a list of all inspirations """
-        key = cache_key('inspirations', user.pk)
-        inspirations = cache.get(key)
+        """
+        Return a list of all inspirations. Hot accounts only get their
+        first `follower_page`, their full lists are neither loaded nor
+        cached.
+        """
+        inspirations = cache_get('inspirations', user.pk)
 
         if inspirations is None:
-            qs = Inspiration.objects.filter(inspired_by=user).select_related(max_depth=2)
+            if self.is_hot(user):
+                return self.follower_page(user)
+
+            qs = Inspiration.objects.filter(inspired_by=user)\
+                .select_related(max_depth=2)
             inspirations = [u.user for u in qs]
-            cache.set(key, inspirations)
+            # the account may have turned hot since `is_hot`
+            if HOT_ACCOUNT_FOLLOWERS is None or len(inspirations) < HOT_ACCOUNT_FOLLOWERS:
+                cache_set('inspirations', user.pk, inspirations)
 
         return inspirations
 
+    def follower_count(self, user):
+        """
+        Return the number of followers, approximate: adjusted in place on
+        every (un)follow and recounted every FRIENDSHIP_FOLLOWER_PAGE_TIMEOUT
+        """
+        count = counter_get('follower_count', user.pk)
+
+        if count is None:
+            count = Inspiration.objects.filter(inspired_by=user).count()
+            counter_set('follower_count', user.pk, count, FOLLOWER_PAGE_TIMEOUT)
+
+        return count
+
+    def follower_counts(self, user_pks):
+        """
+        Return {user_pk: approximate number of followers} for many users,
+        counting those without a cached counter with one aggregation
+        """
+        counts = counter_get_many('follower_count', user_pks)
+        missing = [pk for pk in user_pks if pk not in counts]
+
+        for chunk in chunked(missing, QUERY_BATCH_SIZE):
+            result = Inspiration._get_collection().aggregate([
+                {'$match': {'inspired_by': {'$in': chunk}}},
+                {'$group': {'_id': '$inspired_by', 'count': {'$sum': 1}}},
+            ])
+            if isinstance(result, dict):
+                # pymongo < 3
+                result = result['result']
+            found = dict((doc['_id'], doc['count']) for doc in result)
+            for pk in chunk:
+                counts[pk] = found.get(pk, 0)
+                counter_set('follower_count', pk, counts[pk], FOLLOWER_PAGE_TIMEOUT)
+
+        return counts
+
+    def is_hot(self, user):
+        """
+        Does the user have at least FRIENDSHIP_HOT_ACCOUNT_FOLLOWERS followers?
+        """
+        return (HOT_ACCOUNT_FOLLOWERS is not None and
+                self.follower_count(user) >= HOT_ACCOUNT_FOLLOWERS)
+
+    def follower_page(self, user, page=0):
+        """
+        Return a page of FRIENDSHIP_FOLLOWER_PAGE_SIZE followers, newest
+        first. Pages aren't busted by (un)follows, they expire after
+        FRIENDSHIP_FOLLOWER_PAGE_TIMEOUT, so following a hot account never
+        drops a huge cached list.
+        """
+        key = '%s-%s' % (user.pk, page)
+        followers = cache_get('follower_page', key)
+
+        if followers is None:
+            qs = for_cache_refill(Inspiration.objects.filter(inspired_by=user))\
+                .order_by('-created').skip(page * FOLLOWER_PAGE_SIZE)\
+                .limit(FOLLOWER_PAGE_SIZE).select_related(max_depth=2)
+            followers = [u.user for u in qs]
+            cache_set('follower_page', key, followers, FOLLOWER_PAGE_TIMEOUT)
+
+        return followers
+
+    def new_followers(self, user, since=None, limit=None):
+        """
+        Return followers newest first, optionally only those following
+        since a datetime, at most `limit` (FRIENDSHIP_RECENT_CACHE_SIZE)
+        of them
+        """
+        rels = recent_relations('new_followers', Inspiration, 'inspired_by', user,
+                                since=since, limit=limit)
+        return [rel.user for rel in rels]
+
+    def iter_follower_ids(self, user, after=None, until=None, batch_size=None):
+        """
+        Stream (checkpoint, follower_pk) pairs of user's followers,
+        see `stream_ids`
+        """
+        return stream_ids(Inspiration.objects.filter(inspired_by=user), 'user',
+                          after=after, until=until, batch_size=batch_size)
+
+    def follower_id_ranges(self, user, parts):
+        """
+        Split user's followers into disjoint (after, until) ranges
+        to be consumed by `iter_follower_ids` in parallel
+        """
+        return split_id_ranges(Inspiration.objects.filter(inspired_by=user), parts)
+
     def user_inspired_by(self, user):
         """ Return a list of all users the given user follows """
-        key = cache_key('inspirationals', user.pk)
-        inspirationals = cache.get(key)
+        inspirationals = cache_get('inspirationals', user.pk)
 
         if inspirationals is None:
-            qs = Inspiration.objects.filter(user=user).select_related(max_depth=2)
+            qs = Inspiration.objects.filter(user=user)\
+                .select_related(max_depth=2)
             inspirationals = [u.inspired_by for u in qs]
-            cache.set(key, inspirationals)
+            cache_set('inspirationals', user.pk, inspirationals)
 
         return inspirationals
 
@@ -436,6 +1378,8 @@ class InspirationQuerySet(QuerySet):
         if user == inspired_by:
             raise ValidationError("Users cannot inspire themselves")
 
+        check_rate_limit('add_inspiration', user.pk)
+
         relation = Inspiration.objects(user=user, inspired_by=inspired_by)\
             .modify(new=False, upsert=True, set__user=user,
                     set__inspired_by=inspired_by, set__created=timezone.now())
@@ -443,10 +1387,17 @@ class InspirationQuerySet(QuerySet):
         if relation is not None:
             raise AlreadyExistsError("User '%s' already inspired by '%s'" % (user, inspired_by))
 
-        relation = Inspiration.objects(user=user, inspired_by=inspired_by).first()
+        relation = Inspiration.objects(user=user, inspired_by=inspired_by)\
+            .read_preference(ReadPreference.PRIMARY).first()
+
+        record_event('inspiration_created', user, inspired_by)
+        summary_changed(inspired_by.pk, inc={'followers_count': 1},
+                        push={'follower_ids': user.pk})
+        summary_changed(user.pk, inc={'following_count': 1})
+        counter_incr('follower_count', inspired_by.pk)
 
-        inspirations_created.send(sender=self, user=user)
-        inspirationals_created.send(sender=self, inspired_by=inspired_by)
+        send_signal(inspirations_created, sender=self, user=user)
+        send_signal(inspirationals_created, sender=self, inspired_by=inspired_by)
 
         bust_cache('inspirations', inspired_by.pk)
         bust_cache('inspirationals', user.pk)
@@ -457,9 +1408,14 @@ class InspirationQuerySet(QuerySet):
         """ Remove 'user' inspired by 'inspired_by' relationship """
         try:
             rel = Inspiration.objects.get(user=user, inspired_by=inspired_by)
-            inspirations_removed.send(sender=rel, user=rel.user)
-            inspirationals_removed.send(sender=rel, inspired_by=rel.inspired_by)
+            send_signal(inspirations_removed, sender=rel, user=rel.user)
+            send_signal(inspirationals_removed, sender=rel, inspired_by=rel.inspired_by)
             rel.delete()
+            record_event('inspiration_removed', user, inspired_by)
+            summary_changed(inspired_by.pk, inc={'followers_count': -1},
+                            pull={'follower_ids': user.pk})
+            summary_changed(user.pk, inc={'following_count': -1})
+            counter_incr('follower_count', inspired_by.pk, -1)
             bust_cache('inspirations', inspired_by.pk)
             bust_cache('inspirationals', user.pk)
             return True
@@ -468,19 +1424,53 @@ class InspirationQuerySet(QuerySet):
 
     def is_inspired(self, user, inspired_by):
         """ Does user inspired by inspirational? Smartly uses caches if exists """
-        inspirations = cache.get(cache_key('inspirationals', user.pk))
-        inspirationals = cache.get(cache_key('inspirations', inspired_by.pk))
+        return self.inspired_map(user, [inspired_by])[inspired_by.pk]
+
+    def inspired_map(self, user, targets):
+        """
+        Return {target_pk: bool} telling whether the user is inspired by
+        each of the targets (e.g. to render follow buttons of a user list).
+        Only the user's own (following) list is read from the cache, never
+        the possibly huge follower lists of the targets.
+        """
+        targets = list(targets)
+        inspirationals = cache_get('inspirationals', user.pk)
+        if inspirationals is not None:
+            related = set(u.pk for u in inspirationals)
+            return dict((u.pk, u.pk in related) for u in targets)
+
+        return self._load_relation_map(
+            {'user': user}, 'inspired_by', [u.pk for u in targets])
+
+    def followers_among(self, user, candidates):
+        """
+        Return those of candidates who are inspired by the user, from
+        the following lists of the candidates
+        """
+        candidates = list(candidates)
+        cached = cache_get_many(('inspirationals', u.pk) for u in candidates)
+
+        followers = {}
+        missing = []
+        for u in candidates:
+            inspirationals = cached.get(('inspirationals', u.pk))
+            if inspirationals is not None:
+                followers[u.pk] = any(i.pk == user.pk for i in inspirationals)
+            else:
+                missing.append(u.pk)
 
-        if inspirations and inspired_by in inspirations:
-            return True
-        elif inspirationals and user in inspirationals:
-            return True
-        else:
-            try:
-                Inspiration.objects.get(user=user, inspired_by=inspired_by)
-                return True
-            except Inspiration.DoesNotExist:
-                return False
+        followers.update(self._load_relation_map({'inspired_by': user}, 'user', missing))
+        return [u for u in candidates if followers[u.pk]]
+
+    def _load_relation_map(self, query, field, pks):
+        """ Return {pk: bool} of `field` values matching query, one `$in` """
+        if not pks:
+            return {}
+
+        qs = Inspiration.objects.filter(**dict(query, **{field + '__in': pks}))\
+            .only(field).as_pymongo()
+        found = set(rel[field] for rel in qs)
+        return dict((pk, pk in found) for pk in pks)
 
 
 @python_2_unicode_compatible
@@ -497,8 +1487,10 @@ class Inspiration(Document):
     TODO:
     1) ensure that (user, inspired_by) and (inspired_by, user) are not the same;
     """
-    user = fields.ReferenceField(get_user_model())
-    inspired_by = fields.ReferenceField(get_user_model(), unique_with='user')
+    user = fields.ReferenceField(get_user_model(),
+                                 unique_with='inspired_by' if SHARDING else None)
+    inspired_by = fields.ReferenceField(get_user_model(),
+                                        unique_with=None if SHARDING else 'user')
     created = fields.DateTimeField(default=timezone.now, null=True)
 
     meta = {
@@ -506,7 +1498,12 @@ class Inspiration(Document):
             'user',
             'inspired_by',
             ('user', 'inspired_by'),
+            ('inspired_by', '-created'),
+            # `iter_follower_ids` and `follower_id_ranges` walk followers by `_id`
+            ('inspired_by', 'id'),
         ],
+        'shard_key': ('user',) if SHARDING else (),
+        'db_alias': DB_ALIAS,
         'queryset_class': InspirationQuerySet
     }
 
@@ -528,13 +1525,13 @@ class Inspiration(Document):
 class BlockingQuerySet(QuerySet):
 
     def blocked_for_user(self, user):
-        key = cache_key('blocked', user.pk)
-        blocked = cache.get(key)
+        blocked = cache_get('blocked', user.pk)
 
         if blocked is None:
-            qs = Blocking.objects.filter(from_user=user).select_related(max_depth=2)
+            qs = Blocking.objects.filter(from_user=user)\
+                .select_related(max_depth=2)
             blocked = [u.to_user for u in qs]
-            cache.set(key, blocked)
+            cache_set('blocked', user.pk, blocked)
 
         return blocked
 
@@ -543,61 +1540,160 @@ class BlockingQuerySet(QuerySet):
         if from_user == to_user:
             raise ValidationError("Users cannot block themselves")
 
-        relation = Blocking.objects(from_user=from_user, to_user=to_user)\
-            .modify(new=False, upsert=True, set__from_user=from_user,
-                    set__to_user=to_user, set__created=timezone.now())
+        # friendship removal, rejections and cancellations below send
+        # their signals and bust caches once, when the block is done
+        with batch():
+            relation = Blocking.objects(from_user=from_user, to_user=to_user)\
+                .modify(new=False, upsert=True, set__from_user=from_user,
+                        set__to_user=to_user, set__created=timezone.now())
 
-        Friend.objects.remove_friend(from_user, to_user)
+            Friend.objects.remove_friend(from_user, to_user)
 
-        # reject all requests from `to_user`
-        to_user_requests = FriendshipRequest.objects.filter(
-            from_user=to_user,
-            to_user=from_user)
+            # reject all requests from `to_user`
+            to_user_requests = FriendshipRequest.objects.filter(
+                from_user=to_user,
+                to_user=from_user)
 
-        for req in to_user_requests:
-            req.reject()
+            for req in to_user_requests:
+                req.reject()
 
-        # .. and cancel all requests from 'from_user' to 'to_user'
-        from_user_requests = FriendshipRequest.objects.filter(
-            from_user=from_user,
-            to_user=to_user)
+            # .. and cancel all requests from 'from_user' to 'to_user'
+            from_user_requests = FriendshipRequest.objects.filter(
+                from_user=from_user,
+                to_user=to_user)
 
-        for req in from_user_requests:
-            req.cancel()
+            for req in from_user_requests:
+                req.cancel()
 
-        if relation is not None:
-            raise AlreadyExistsError("User '%s' already blocked '%s'" % (from_user, to_user))
+            if relation is not None:
+                raise AlreadyExistsError("User '%s' already blocked '%s'" % (from_user, to_user))
+
+            relation = Blocking.objects(from_user=from_user, to_user=to_user)\
+                .read_preference(ReadPreference.PRIMARY).first()
 
-        relation = Blocking.objects(from_user=from_user, to_user=to_user).first()
+            record_event('blocking_created', from_user, to_user)
+            summary_changed(from_user.pk, inc={'blocked_count': 1})
 
-        blocking_created.send(sender=self, from_user=from_user, to_user=to_user)
+            send_signal(blocking_created, sender=self, from_user=from_user, to_user=to_user)
 
-        bust_cache('blocked', from_user.pk)
+            bust_cache('blocked', from_user.pk)
+            bust_cache('blocked_by', to_user.pk)
 
         return relation
 
     def remove_blocking(self, from_user, to_user):
         """ Remove 'user' blocked 'to_user' relationship """
+        if self._cached_block(from_user, to_user) is False:
+            return False
+
         try:
             rel = Blocking.objects.get(from_user=from_user, to_user=to_user)
-            blocking_removed.send(sender=rel, from_user=rel.from_user, to_user=rel.to_user)
+            send_signal(blocking_removed, sender=rel, from_user=rel.from_user, to_user=rel.to_user)
             rel.delete()
+            record_event('blocking_removed', from_user, to_user)
+            summary_changed(from_user.pk, inc={'blocked_count': -1})
             bust_cache('blocked', from_user.pk)
+            bust_cache('blocked_by', to_user.pk)
             return True
         except Blocking.DoesNotExist:
             return False
 
+    def blocked_by(self, user):
+        """ Return a list of users who blocked the given user """
+        blocked_by = cache_get('blocked_by', user.pk)
+
+        if blocked_by is None:
+            qs = Blocking.objects.filter(to_user=user)\
+                .select_related(max_depth=2)
+            blocked_by = [u.from_user for u in qs]
+            cache_set('blocked_by', user.pk, blocked_by)
+
+        return blocked_by
+
     def is_blocked(self, from_user, to_user):
         """ Is to_user blocked by from_user? """
-        blocked = cache.get(cache_key('blocked', from_user.pk))
-        if blocked and to_user in blocked:
+        blocked = self._cached_block(from_user, to_user)
+        if blocked is not None:
+            return blocked
+
+        try:
+            Blocking.objects.get(from_user=from_user, to_user=to_user)
+            return True
+        except Blocking.DoesNotExist:
+            return False
+
+    def is_blocked_either_way(self, user1, user2):
+        """ Has any of the users blocked the other one? """
+        cached = cache_get_many([
+            ('blocked', user1.pk), ('blocked_by', user1.pk),
+            ('blocked', user2.pk), ('blocked_by', user2.pk),
+        ])
+        forward = self._cached_block(user1, user2, cached)
+        backward = self._cached_block(user2, user1, cached)
+
+        if forward or backward:
             return True
+
+        queries = []
+        if forward is None:
+            queries.append(Q(from_user=user1, to_user=user2))
+        if backward is None:
+            queries.append(Q(from_user=user2, to_user=user1))
+
+        return any(Blocking.objects.filter(query).only('id').first() is not None
+                   for query in owner_queries(queries))
+
+    def filter_blocked(self, viewer, users):
+        """
+        Return users except those who blocked the viewer or were blocked
+        by the viewer, e.g. to clean up search and suggestion results
+        """
+        cached = cache_get_many([('blocked', viewer.pk), ('blocked_by', viewer.pk)])
+        blocked = cached.get(('blocked', viewer.pk))
+        blocked_by = cached.get(('blocked_by', viewer.pk))
+        user_pks = [u.pk for u in users]
+
+        excluded = set()
+        queries = []
+        if blocked is not None:
+            excluded.update(u.pk for u in blocked)
         else:
-            try:
-                Blocking.objects.get(from_user=from_user, to_user=to_user)
-                return True
-            except Blocking.DoesNotExist:
-                return False
+            queries.append(Q(from_user=viewer, to_user__in=user_pks))
+        if blocked_by is not None:
+            excluded.update(u.pk for u in blocked_by)
+        else:
+            queries.append(Q(from_user__in=user_pks, to_user=viewer))
+
+        if not user_pks:
+            queries = []
+
+        for query in owner_queries(queries):
+            qs = Blocking.objects.filter(query).only('from_user', 'to_user').as_pymongo()
+            for block in qs:
+                if block['from_user'] == viewer.pk:
+                    excluded.add(block['to_user'])
+                else:
+                    excluded.add(block['from_user'])
+
+        return [u for u in users if u.pk not in excluded]
+
+    def _cached_block(self, from_user, to_user, cached=None):
+        """
+        Answer whether to_user is blocked by from_user from cached lists
+        of either side, None if neither is cached
+        """
+        if cached is None:
+            cached = cache_get_many([('blocked', from_user.pk), ('blocked_by', to_user.pk)])
+
+        blocked = cached.get(('blocked', from_user.pk))
+        if blocked is not None:
+            return to_user in blocked
+
+        blocked_by = cached.get(('blocked_by', to_user.pk))
+        if blocked_by is not None:
+            return from_user in blocked_by
+
+        return None
 
 
 @python_2_unicode_compatible
@@ -609,10 +1705,11 @@ class Blocking(Document):
 
     from_user = fields.ReferenceField(
         get_user_model(),
+        unique_with='to_user' if SHARDING else None,
         verbose_name=_("from user"))
     to_user = fields.ReferenceField(
         get_user_model(),
-        unique_with='from_user',
+        unique_with=None if SHARDING else 'from_user',
         verbose_name=_("to user"))
     created = fields.DateTimeField(
         verbose_name=_("created"),
@@ -624,6 +1721,8 @@ class Blocking(Document):
             'to_user',
             ('from_user', 'to_user')
         ],
+        'shard_key': ('from_user',) if SHARDING else (),
+        'db_alias': DB_ALIAS,
         'queryset_class': BlockingQuerySet
     }
 
@@ -632,76 +1731,248 @@ class Blocking(Document):
             self.from_user, self.to_user)
 
 
+class RelationshipSummaryQuerySet(QuerySet):
+    """ Relationship summary manager """
+
+    def for_user(self, user):
+        """
+        Return {field: value} of the user's summary (counts and newest
+        friend/follower ids) with one cache get, or one document read
+        on a cache miss
+        """
+        summary = cache_get('summary', user.pk)
+
+        if summary is None:
+            document = None
+            if USE_SUMMARY:
+                document = RelationshipSummary.objects(pk=user.pk).first()
+            if document is None or not document.is_complete():
+                document = self.rebuild(user.pk)
+            summary = document.to_dict()
+            cache_set('summary', user.pk, summary)
+
+        return summary
+
+    def rebuild(self, user_pk):
+        """
+        Compute the summary from relationships (and store it if
+        FRIENDSHIP_USE_SUMMARY is on). The stored document is only
+        replaced if no change adjusted it while counting (its `version`
+        is the same), otherwise it stays incomplete and is rebuilt on
+        the next read.
+        """
+        if USE_SUMMARY:
+            # changes made while counting must find a document to bump
+            version = RelationshipSummary.objects(pk=user_pk).modify(
+                upsert=True, new=True,
+                __raw__={'$setOnInsert': {'version': 0}}).version
+
+        def newest(document, owner, related):
+            qs = document.objects.filter(**{owner: user_pk}).order_by('-created')\
+                .limit(SUMMARY_SIZE).only(related).as_pymongo()
+            return [rel[related] for rel in qs]
+
+        document = RelationshipSummary(
+            user=user_pk,
+            friends_count=Friend.objects.filter(from_user=user_pk).count(),
+            followers_count=Inspiration.objects.filter(inspired_by=user_pk).count(),
+            following_count=Inspiration.objects.filter(user=user_pk).count(),
+            blocked_count=Blocking.objects.filter(from_user=user_pk).count(),
+            unread_request_count=FriendshipRequest.objects.filter(
+                to_user=user_pk, viewed=None).count(),
+            unrejected_request_count=FriendshipRequest.objects.filter(
+                to_user=user_pk, rejected=None).count(),
+            friend_ids=newest(Friend, 'from_user', 'to_user'),
+            follower_ids=newest(Inspiration, 'inspired_by', 'user'),
+            rebuilt=datetime.utcnow())
+
+        if USE_SUMMARY:
+            data = document.to_mongo()
+            data.pop('_id', None)
+            data.pop('version', None)
+            # documents stored before they were versioned have no `version`
+            current = version if version else {'$in': [0, None]}
+            RelationshipSummary.objects(__raw__={'_id': user_pk, 'version': current})\
+                .update_one(__raw__={'$set': data, '$inc': {'version': 1}})
+        return document
+
+
+class RelationshipSummary(Document):
+    """
+    Materialised relationship counts and the newest friends/followers of
+    a user, adjusted in place on every change (see `summary_changed`)
+    """
+    user = fields.ObjectIdField(primary_key=True)
+    friends_count = fields.IntField(default=0)
+    followers_count = fields.IntField(default=0)
+    following_count = fields.IntField(default=0)
+    blocked_count = fields.IntField(default=0)
+    unread_request_count = fields.IntField(default=0)
+    unrejected_request_count = fields.IntField(default=0)
+    friend_ids = fields.ListField(fields.ObjectIdField())
+    follower_ids = fields.ListField(fields.ObjectIdField())
+    # bumped by every change, see `RelationshipSummaryQuerySet.rebuild`
+    version = fields.IntField(default=0)
+    # naive UTC, None until the first complete rebuild
+    rebuilt = fields.DateTimeField()
+
+    COUNTS = (
+        'friends_count',
+        'followers_count',
+        'following_count',
+        'blocked_count',
+        'unread_request_count',
+        'unrejected_request_count',
+    )
+
+    meta = {
+        'db_alias': DB_ALIAS,
+        'queryset_class': RelationshipSummaryQuerySet
+    }
+
+    def is_complete(self):
+        """
+        Removals may empty the newest ids while older relationships
+        remain, lost updates may turn counts negative, and documents
+        older than FRIENDSHIP_SUMMARY_MAX_AGE may have drifted
+        """
+        if self.rebuilt is None:
+            return False
+        if SUMMARY_MAX_AGE is not None and \
+                self.rebuilt < datetime.utcnow() - timedelta(seconds=SUMMARY_MAX_AGE):
+            return False
+        return (all(getattr(self, name) >= 0 for name in self.COUNTS) and
+                len(self.friend_ids) >= min(SUMMARY_SIZE, self.friends_count) and
+                len(self.follower_ids) >= min(SUMMARY_SIZE, self.followers_count))
+
+    def to_dict(self):
+        summary = dict((name, getattr(self, name)) for name in self.COUNTS)
+        summary['friend_ids'] = list(self.friend_ids)
+        summary['follower_ids'] = list(self.follower_ids)
+        return summary
 
-# signals receivers to send notifications
 
-if "notification" in settings.INSTALLED_APPS:
-    from notification import models as notification
-else:
-    notification = None
-
-def send_request_sent_notification(sender, instance, created, **kwargs):
-    if notification and created:
-        notification.send([instance.to_user],
-            "friendship_request", {"request": instance})
-        notification.send([instance.from_user],
-            "friendship_request_sent", {"request": instance})
-
-def send_acceptance_sent_notification(sender, instance, created, **kwargs):
-    if notification and created:
-        notification.send([instance.to_user],
-            "friendship_accept_sent", {"from_user": instance.from_user})
-        notification.send([instance.from_user],
-            "friendship_accept", {"to_user": instance.to_user})
-
-def send_otherconnect_notification(sender, instance, created, **kwargs):
-    if notification and created:
-        for user in Friend.objects.friends(instance.to_user):
-            if user != instance.from_user:
-                notification.send([user],
-                    "friendship_otherconnect",
-                    {"your_friend": instance.to_user,
-                    "new_friend": instance.from_user})
-
-        for user in Friend.objects.friends(instance.from_user):
-            if user != instance.to_user:
-                notification.send([user],
-                    "friendship_otherconnect",
-                    {"your_friend": instance.from_user,
-                    "new_friend": instance.to_user})
-
-def send_friend_removed_notification(sender, instance, **kwargs):
-    if notification:
-        notification.send([instance.to_user],
-            "friendship_friend_removed",
-            {"removed_friend": instance.from_user})
-
-        notification.send([instance.from_user],
-            "friendship_friend_removed",
-            {"removed_friend": instance.to_user})
-
-
-
-if notification and USE_NOTIFICATION_APP:
-
-    signals.post_save.connect(
-        send_request_sent_notification,
-        sender=FriendshipRequest,
-        dispatch_uid="friendship_send_request_sent_notification")
-
-    signals.post_save.connect(
-        send_acceptance_sent_notification,
-        sender=Friend,
-        dispatch_uid="friendship_send_acceptance_sent_notification")
-
-    if NOTIFY_ABOUT_NEW_FRIENDS_OF_FRIEND:
-        signals.post_save.connect(
-            send_otherconnect_notification,
-            sender=Friend,
-            dispatch_uid="friendship_send_otherconnect_notification")
-
-    if NOTIFY_ABOUT_FRIENDS_REMOVAL:
-        signals.pre_delete.connect(
-            send_friend_removed_notification,
-            sender=Friend,
-            dispatch_uid="friendship_send_friend_removed_notification")
+def summary_changed(user_pk, inc=None, push=None, pull=None):
+    """
+    Adjust the stored summary of the user with a single atomic update:
+    `inc` counts, `push` ids in front of the newest ones (keeping
+    FRIENDSHIP_SUMMARY_SIZE of them), `pull` ids out. Missing summaries
+    are rebuilt on read, so nothing is upserted.
+    """
+    bust_cache('summary', user_pk)
+    if not USE_SUMMARY:
+        return
+
+    update = {}
+    inc = dict((name, value) for name, value in (inc or {}).items() if value)
+    if inc:
+        update['$inc'] = inc
+    if push:
+        update['$push'] = dict(
+            (name, {'$each': [pk], '$position': 0, '$slice': SUMMARY_SIZE})
+            for name, pk in push.items())
+    if pull:
+        update['$pull'] = pull
+    if update:
+        update.setdefault('$inc', {})['version'] = 1
+        RelationshipSummary.objects(pk=user_pk).update_one(__raw__=update)
+
+
+def invalidate_summaries(user_pks):
+    """ Drop summaries which can't be adjusted, they are rebuilt on read """
+    user_pks = list(user_pks)
+    if USE_SUMMARY:
+        RelationshipSummary.objects(pk__in=user_pks).delete()
+    bust_caches('summary', user_pks)
+
+
+# caches filled by `warm_caches`
+WARMABLE_CACHES = (
+    'friends',
+    'requests',
+    'unread_request_count',
+    'inspirations',
+    'inspirationals',
+    'blocked',
+    'blocked_by',
+)
+
+
+def warm_caches(user_pks, kinds=WARMABLE_CACHES):
+    """
+    Fill relationship caches of many users with one `$in` query and a few
+    `set_many` calls per kind (counters are added one by one, so they
+    never overwrite increments), return the number of cached keys
+    """
+    loaded = {}
+
+    def load(kind, document, owner, related, pks=user_pks):
+        lists = loaded[kind] = dict((pk, []) for pk in pks)
+        for chunk in chunked(pks, QUERY_BATCH_SIZE):
+            qs = for_cache_refill(document.objects.filter(**{owner + '__in': chunk}))
+            for rel in qs.select_related(max_depth=2):
+                lists[getattr(rel, owner).pk].append(
+                    getattr(rel, related) if related else rel)
+
+    if 'friends' in kinds:
+        load('friends', Friend, 'from_user', 'to_user')
+    if 'inspirations' in kinds:
+        # follower lists of hot accounts aren't cached, so they aren't loaded
+        hot = set()
+        if HOT_ACCOUNT_FOLLOWERS is not None:
+            hot = set(pk for pk, count in Inspiration.objects.follower_counts(user_pks).items()
+                      if count >= HOT_ACCOUNT_FOLLOWERS)
+        load('inspirations', Inspiration, 'inspired_by', 'user',
+             [pk for pk in user_pks if pk not in hot])
+    if 'inspirationals' in kinds:
+        load('inspirationals', Inspiration, 'user', 'inspired_by')
+    if 'blocked' in kinds:
+        load('blocked', Blocking, 'from_user', 'to_user')
+    if 'blocked_by' in kinds:
+        load('blocked_by', Blocking, 'to_user', 'from_user')
+    if 'requests' in kinds or 'unread_request_count' in kinds:
+        load('requests', FriendshipRequest, 'to_user', None)
+
+    values = {}
+    counters = 0
+    for kind in kinds:
+        for pk in user_pks:
+            if kind == 'unread_request_count':
+                counter_set(kind, pk, len(
+                    [r for r in loaded['requests'][pk] if r.viewed is None]))
+                counters += 1
+            elif kind == 'inspirations' and (
+                    pk not in loaded[kind] or
+                    HOT_ACCOUNT_FOLLOWERS is not None and
+                    len(loaded[kind][pk]) >= HOT_ACCOUNT_FOLLOWERS):
+                # see `InspirationQuerySet.inspired_by_user`
+                continue
+            else:
+                values[(kind, pk)] = loaded[kind][pk]
+
+    cache_set_many(values)
+    return len(values) + counters
+
+
+def prefetch_relationships(sender, user, **kwargs):
+    """
+    `user_logged_in` receiver warming relationship caches of the user
+    in a background thread, see FRIENDSHIP_PREFETCH_ON_LOGIN
+    """
+    thread = threading.Thread(target=warm_caches, args=([user.pk],))
+    thread.daemon = True
+    thread.start()
+
+
+if PREFETCH_ON_LOGIN:
+    from django.contrib.auth.signals import user_logged_in
+
+    user_logged_in.connect(
+        prefetch_relationships,
+        dispatch_uid="friendship_prefetch_relationships")
+
+
+if USE_NOTIFICATION_APP or NOTIFIER is not None:
+    from friendship.notifications import connect_receivers
+
+    connect_receivers()
@@ -0,0 +1,181 @@
+"""
+Notification backends, see FRIENDSHIP_NOTIFIER.
+
+Nothing is imported until the first notification is sent, so processes
+which never notify don't pay for django-notification.
+"""
+from django.conf import settings
+from django.utils.translation import ugettext_noop as _
+
+from friendship.compat import import_string
+from friendship.settings import (NOTIFIER, USE_NOTIFICATION_APP,
+    NOTIFY_ABOUT_NEW_FRIENDS_OF_FRIEND, NOTIFY_ABOUT_FRIENDS_REMOVAL)
+from friendship.signals import (friendship_request_created,
+    friendship_request_accepted, friendship_removed)
+
+
+# (label, display, description, enabled)
+NOTICE_TYPES = (
+    ("friendship_request",
+     _("Invitation received"),
+     _("You have received an invitation."),
+     True),
+    ("friendship_request_sent",
+     _("Invitation sent"),
+     _("You have sent an invitation."),
+     True),
+    ("friendship_accept",
+     _("Acceptance received"),
+     _("An invitation you sent has been accepted."),
+     True),
+    ("friendship_accept_sent",
+     _("Acceptance sent"),
+     _("You have accepted an invitation you received."),
+     True),
+    ("friendship_otherconnect",
+     _("Other connection"),
+     _("One of your friends has a new friend."),
+     NOTIFY_ABOUT_NEW_FRIENDS_OF_FRIEND),
+    ("friendship_friend_removed",
+     _("Friend removed"),
+     _("One person was removed from your friends."),
+     NOTIFY_ABOUT_FRIENDS_REMOVAL),
+)
+
+
+class BaseNotifier(object):
+    """ Interface of notification backends """
+    # receivers skip building notices (and dereferencing users) if False
+    enabled = True
+
+    def send(self, users, label, extra_context=None):
+        raise NotImplementedError
+
+    def create_notice_types(self):
+        """ Register NOTICE_TYPES with the backend, if it needs that """
+        pass
+
+
+class NullNotifier(BaseNotifier):
+    """ Drops every notification """
+    enabled = False
+
+    def send(self, users, label, extra_context=None):
+        pass
+
+
+class DjangoNotificationNotifier(BaseNotifier):
+    """ Sends notifications right away with django-notification """
+
+    def __init__(self):
+        from notification import models as notification
+        self.notification = notification
+
+    def send(self, users, label, extra_context=None):
+        self.notification.send(users, label, extra_context)
+
+    def create_notice_types(self):
+        for label, display, description, enabled in NOTICE_TYPES:
+            if enabled:
+                self.notification.create_notice_type(
+                    label, display, description, default=1)
+
+
+class BatchedNotifier(DjangoNotificationNotifier):
+    """
+    Queues notifications with django-notification, they are sent
+    later by its `emit_notices` command
+    """
+
+    def send(self, users, label, extra_context=None):
+        self.notification.queue(users, label, extra_context)
+
+
+_notifier = None
+
+
+def get_notifier():
+    """
+    Return the notifier configured by FRIENDSHIP_NOTIFIER, by default
+    django-notification if installed (and FRIENDSHIP_USE_NOTIFICATION_APP
+    is on), otherwise NullNotifier. Resolved on first use.
+    """
+    global _notifier
+    if _notifier is None:
+        path = NOTIFIER
+        if path is None:
+            if USE_NOTIFICATION_APP and "notification" in settings.INSTALLED_APPS:
+                path = 'friendship.notifications.DjangoNotificationNotifier'
+            else:
+                path = 'friendship.notifications.NullNotifier'
+        _notifier = import_string(path)()
+    return _notifier
+
+
+# signals receivers to send notifications
+
+def send_request_sent_notification(sender, **kwargs):
+    notifier = get_notifier()
+    if not notifier.enabled:
+        return
+    notifier.send([sender.to_user],
+        "friendship_request", {"request": sender})
+    notifier.send([sender.from_user],
+        "friendship_request_sent", {"request": sender})
+
+
+def send_acceptance_sent_notification(sender, from_user, to_user, **kwargs):
+    notifier = get_notifier()
+    if not notifier.enabled:
+        return
+    notifier.send([to_user],
+        "friendship_accept_sent", {"from_user": from_user})
+    notifier.send([from_user],
+        "friendship_accept", {"to_user": to_user})
+
+
+def send_otherconnect_notification(sender, from_user, to_user, **kwargs):
+    from friendship.models import Friend
+
+    notifier = get_notifier()
+    if not notifier.enabled:
+        return
+    for your_friend, new_friend in ((to_user, from_user), (from_user, to_user)):
+        for user in Friend.objects.friends(your_friend):
+            if user != new_friend:
+                notifier.send([user],
+                    "friendship_otherconnect",
+                    {"your_friend": your_friend,
+                    "new_friend": new_friend})
+
+
+def send_friend_removed_notification(sender, from_user, to_user, **kwargs):
+    # sent once per edge, so each side is notified once
+    notifier = get_notifier()
+    if not notifier.enabled:
+        return
+    notifier.send([to_user],
+        "friendship_friend_removed",
+        {"removed_friend": from_user})
+
+
+def connect_receivers():
+    """ Notify about relationship changes through `get_notifier` """
+    friendship_request_created.connect(
+        send_request_sent_notification,
+        dispatch_uid="friendship_send_request_sent_notification")
+
+    friendship_request_accepted.connect(
+        send_acceptance_sent_notification,
+        dispatch_uid="friendship_send_acceptance_sent_notification")
+
+    if NOTIFY_ABOUT_NEW_FRIENDS_OF_FRIEND:
+        friendship_request_accepted.connect(
+            send_otherconnect_notification,
+            dispatch_uid="friendship_send_otherconnect_notification")
+
+    if NOTIFY_ABOUT_FRIENDS_REMOVAL:
+        friendship_removed.connect(
+            send_friend_removed_notification,
+            dispatch_uid="friendship_send_friend_removed_notification")
+
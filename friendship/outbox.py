@@ -0,0 +1,131 @@
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+
+from mongoengine import fields, Document
+
+from friendship.settings import (USE_OUTBOX, OUTBOX_TTL, OUTBOX_BATCH_SIZE,
+    OUTBOX_SETTLE_SECONDS, DB_ALIAS)
+
+
+@python_2_unicode_compatible
+class RelationshipEvent(Document):
+    """
+    Append-only log of relationship changes, written by the managers right
+    after each mutation. Events are ordered by `_id`.
+    """
+    kind = fields.StringField(required=True)
+    from_user = fields.ObjectIdField()
+    to_user = fields.ObjectIdField()
+    payload = fields.DictField()
+    created = fields.DateTimeField(default=timezone.now)
+
+    meta = {
+        'db_alias': DB_ALIAS,
+        'indexes': [{
+            'fields': ['created'],
+            'expireAfterSeconds': OUTBOX_TTL,
+        }] if OUTBOX_TTL else [],
+    }
+
+    def __str__(self):
+        return "%s: #%s -> #%s" % (self.kind, self.from_user, self.to_user)
+
+
+class OutboxCheckpoint(Document):
+    """ Position of a named outbox consumer """
+    name = fields.StringField(primary_key=True)
+    position = fields.ObjectIdField()
+    updated = fields.DateTimeField(default=timezone.now)
+
+    meta = {
+        'db_alias': DB_ALIAS,
+    }
+
+
+def record_event(kind, from_user, to_user, **payload):
+    """
+    Append an event to the outbox if FRIENDSHIP_USE_OUTBOX is enabled.
+
+    MongoDB can't write two collections atomically, so the event is
+    written right after the mutation it describes, before any signal.
+    """
+    if not USE_OUTBOX:
+        return None
+
+    event = RelationshipEvent(
+        kind=kind,
+        from_user=from_user.pk,
+        to_user=to_user.pk,
+        payload=payload)
+    event.save(force_insert=True)
+    return event
+
+
+class OutboxConsumer(object):
+    """
+    Tails the outbox in batches for a named consumer.
+
+    Delivery is at-least-once: the checkpoint moves only after the handler
+    has processed a batch, so a batch whose handler failed is read again.
+    """
+
+    def __init__(self, name, batch_size=None, settle_seconds=None):
+        self.name = name
+        self.batch_size = batch_size or OUTBOX_BATCH_SIZE
+        if settle_seconds is None:
+            settle_seconds = OUTBOX_SETTLE_SECONDS
+        self.settle_seconds = settle_seconds
+
+    @property
+    def position(self):
+        """ `_id` of the last processed event or None """
+        checkpoint = OutboxCheckpoint.objects(pk=self.name).first()
+        return checkpoint.position if checkpoint else None
+
+    def read(self, position=None):
+        """ Return the next batch of events after position (or checkpoint) """
+        if position is None:
+            position = self.position
+
+        qs = RelationshipEvent.objects.all()
+        if position is not None:
+            qs = qs.filter(id__gt=position)
+        if self.settle_seconds:
+            # ObjectId.from_datetime takes naive datetimes as UTC, unlike
+            # timezone.now() without USE_TZ
+            settled = datetime.utcnow() - timedelta(seconds=self.settle_seconds)
+            qs = qs.filter(id__lt=ObjectId.from_datetime(settled))
+
+        return list(qs.order_by('id').limit(self.batch_size))
+
+    def commit(self, event):
+        """ Mark event and all events before it as processed """
+        OutboxCheckpoint.objects(pk=self.name).update_one(
+            upsert=True,
+            set__position=event.pk,
+            set__updated=timezone.now())
+
+    def consume(self, handler):
+        """
+        Pass the next batch of events to handler(events) and move the
+        checkpoint. Returns the number of processed events.
+        """
+        events = self.read()
+        if events:
+            handler(events)
+            self.commit(events[-1])
+        return len(events)
+
+    def consume_all(self, handler):
+        """ Consume batches until the outbox is drained """
+        total = 0
+        while True:
+            consumed = self.consume(handler)
+            if not consumed:
+                return total
+            total += consumed
@@ -0,0 +1,121 @@
+"""
+Serializers of values stored under friendship cache keys, see
+FRIENDSHIP_CACHE_SERIALIZER
+"""
+import struct
+import zlib
+
+from bson import BSON, ObjectId
+from bson.binary import Binary
+from django.utils.six.moves import cPickle as pickle
+from mongoengine import Document, ReferenceField
+from mongoengine.base import get_document
+
+from friendship.settings import CACHE_COMPRESS_THRESHOLD
+
+
+class PickleSerializer(object):
+    """
+    Stores values as they are, the cache backend pickles them. Values
+    left by CompactSerializer (e.g. after rolling back from it) are
+    treated as cache misses.
+    """
+
+    def dumps(self, value):
+        return value
+
+    def loads(self, data):
+        if isinstance(data, bytes) and data[:2] == CompactSerializer.MAGIC:
+            return None
+        return data
+
+
+class CompactSerializer(object):
+    """
+    Versioned binary format:
+
+    * counters are stored as integers,
+    * lists of ObjectIds as packed 12 byte ids,
+    * lists of documents as BSON of their `to_mongo()` together with
+      the already dereferenced documents they refer to (so cached
+      requests keep their users),
+    * lists of plain dicts as BSON,
+    * anything else is pickled.
+
+    Values written by another format version (or by another serializer)
+    are treated as cache misses, so rolling deploys never decode data
+    they don't understand.
+    """
+    MAGIC = b'FS'
+    VERSION = 1
+    HEADER = struct.Struct('>2sBB')
+    COMPRESSED = 1
+
+    def __init__(self, compress_threshold=CACHE_COMPRESS_THRESHOLD):
+        self.compress_threshold = compress_threshold
+
+    def dumps(self, value):
+        payload = BSON.encode(self.encode(value))
+        flags = 0
+        if self.compress_threshold is not None and len(payload) > self.compress_threshold:
+            payload = zlib.compress(payload)
+            flags |= self.COMPRESSED
+        return self.HEADER.pack(self.MAGIC, self.VERSION, flags) + payload
+
+    def loads(self, data):
+        if not isinstance(data, bytes) or len(data) < self.HEADER.size:
+            return None
+
+        magic, version, flags = self.HEADER.unpack(data[:self.HEADER.size])
+        if magic != self.MAGIC or version != self.VERSION:
+            return None
+
+        payload = data[self.HEADER.size:]
+        if flags & self.COMPRESSED:
+            payload = zlib.decompress(payload)
+        return self.decode(BSON(payload).decode())
+
+    def encode(self, value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return {'t': 'i', 'v': value}
+        if isinstance(value, list):
+            if all(isinstance(item, ObjectId) for item in value):
+                return {'t': 'o', 'v': Binary(b''.join(item.binary for item in value))}
+            if all(isinstance(item, Document) for item in value):
+                return {'t': 'd', 'v': [self.encode_document(item) for item in value]}
+            if all(type(item) is dict for item in value):
+                return {'t': 'b', 'v': value}
+        return {'t': 'p', 'v': Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))}
+
+    def decode(self, data):
+        kind, value = data['t'], data['v']
+        if kind == 'i':
+            return value
+        if kind == 'o':
+            value = bytes(value)
+            return [ObjectId(value[i:i + 12]) for i in range(0, len(value), 12)]
+        if kind == 'd':
+            return [self.decode_document(item) for item in value]
+        if kind == 'b':
+            return value
+        return pickle.loads(bytes(value))
+
+    def encode_document(self, document):
+        refs = {}
+        for name, field in document._fields.items():
+            related = document._data.get(name)
+            if isinstance(field, ReferenceField) and isinstance(related, Document):
+                refs[name] = self.encode_document(related)
+
+        return {
+            'c': document._class_name,
+            's': document.to_mongo(),
+            'r': refs,
+        }
+
+    def decode_document(self, data):
+        document = get_document(data['c'])._from_son(data['s'])
+        for name, related in data['r'].items():
+            # bypass __setattr__, restored references aren't changes
+            document._data[name] = self.decode_document(related)
+        return document
@@ -15,3 +15,239 @@ NOTIFY_ABOUT_FRIENDS_REMOVAL = getattr(
     settings,
     'NOTIFY_ABOUT_FRIENDS_REMOVAL',
     False)
+
+# dotted path of the notifier class (see friendship.notifications), None -
+# django-notification if installed and enabled above, otherwise nothing
+NOTIFIER = getattr(
+    settings,
+    'FRIENDSHIP_NOTIFIER',
+    None)
+
+# batch size of `$in` queries issued by the graph traversal helpers
+QUERY_BATCH_SIZE = getattr(
+    settings,
+    'FRIENDSHIP_QUERY_BATCH_SIZE',
+    1000)
+
+# hard limit of users visited by degree_of_separation/connection_path
+SEPARATION_MAX_NODES = getattr(
+    settings,
+    'FRIENDSHIP_SEPARATION_MAX_NODES',
+    10000)
+
+# how long (in seconds) shortest paths between two users are cached
+SEPARATION_CACHE_TIMEOUT = getattr(
+    settings,
+    'FRIENDSHIP_SEPARATION_CACHE_TIMEOUT',
+    60 * 15)
+
+# how many relationships are fetched per round trip by the streaming iterators
+STREAM_BATCH_SIZE = getattr(
+    settings,
+    'FRIENDSHIP_STREAM_BATCH_SIZE',
+    1000)
+
+# seconds to keep rejected requests before MongoDB removes them with a TTL
+# index (None - keep forever). Caches of the affected users aren't busted
+# by the TTL monitor, use `cleanup_friendship_requests` when it matters.
+REJECTED_REQUEST_TTL = getattr(
+    settings,
+    'FRIENDSHIP_REJECTED_REQUEST_TTL',
+    None)
+
+# seconds to keep never answered requests, used by
+# `cleanup_friendship_requests` (None - keep forever)
+PENDING_REQUEST_TTL = getattr(
+    settings,
+    'FRIENDSHIP_PENDING_REQUEST_TTL',
+    None)
+
+# {'add_friend': (attempts, seconds), 'add_inspiration': (attempts, seconds)}
+# per user limits of friendship requests and follows, missing entries
+# aren't limited
+RATE_LIMITS = getattr(
+    settings,
+    'FRIENDSHIP_RATE_LIMITS',
+    {})
+
+# mongoengine alias of the database holding friendship documents
+DB_ALIAS = getattr(
+    settings,
+    'FRIENDSHIP_DB_ALIAS',
+    'default')
+
+# keyword arguments of mongoengine.register_connection to create DB_ALIAS
+# with its own connection pool, e.g. {'name': 'friends', 'host': '...'}.
+# Leave None if the alias is registered elsewhere.
+DB_CONNECTION = getattr(
+    settings,
+    'FRIENDSHIP_DB_CONNECTION',
+    None)
+
+# read preference of reads that tolerate replication lag (`warm_caches`,
+# id streams and follower pages): 'primary', 'primaryPreferred',
+# 'secondary', 'secondaryPreferred' or 'nearest'. Writes and refills after
+# cache misses (which usually follow a bust) always go to the primary.
+CACHE_READ_PREFERENCE = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_READ_PREFERENCE',
+    'primary')
+
+# max replication lag (in seconds) of secondaries used to refill caches,
+# requires pymongo >= 3.4 (None - unbounded)
+CACHE_MAX_STALENESS = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_MAX_STALENESS',
+    None)
+
+# write every relationship change to the RelationshipEvent outbox
+# collection, see friendship.outbox
+USE_OUTBOX = getattr(
+    settings,
+    'FRIENDSHIP_USE_OUTBOX',
+    False)
+
+# seconds to keep outbox events (None - forever)
+OUTBOX_TTL = getattr(
+    settings,
+    'FRIENDSHIP_OUTBOX_TTL',
+    None)
+
+# how many events an outbox consumer reads per batch
+OUTBOX_BATCH_SIZE = getattr(
+    settings,
+    'FRIENDSHIP_OUTBOX_BATCH_SIZE',
+    100)
+
+# consumers skip events younger than this many seconds, so events that
+# were assigned an _id earlier but inserted later aren't jumped over
+OUTBOX_SETTLE_SECONDS = getattr(
+    settings,
+    'FRIENDSHIP_OUTBOX_SETTLE_SECONDS',
+    2)
+
+# warm relationship caches of a user in a background thread on login
+PREFETCH_ON_LOGIN = getattr(
+    settings,
+    'FRIENDSHIP_PREFETCH_ON_LOGIN',
+    False)
+
+# dotted path of the serializer of cached relationship data,
+# 'friendship.serializers.CompactSerializer' stores a compact versioned
+# binary format instead of pickled documents
+CACHE_SERIALIZER = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_SERIALIZER',
+    'friendship.serializers.PickleSerializer')
+
+# CompactSerializer compresses values larger than this many bytes
+# (None - never)
+CACHE_COMPRESS_THRESHOLD = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_COMPRESS_THRESHOLD',
+    4096)
+
+# alias of the cache holding relationship data
+CACHE_ALIAS = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_ALIAS',
+    'default')
+
+# prefix of every friendship cache key, e.g. a tenant name
+CACHE_KEY_PREFIX = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_KEY_PREFIX',
+    '')
+
+# {kind: seconds} timeouts of CACHE_TYPES kinds, others use the default
+# timeout of the cache
+CACHE_TIMEOUTS = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_TIMEOUTS',
+    {})
+
+# timeouts are randomly extended by up to this fraction, so keys cached
+# together don't expire together
+CACHE_TIMEOUT_JITTER = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_TIMEOUT_JITTER',
+    0.1)
+
+# lists longer than this aren't cached at all (None - no limit)
+CACHE_MAX_ITEMS = getattr(
+    settings,
+    'FRIENDSHIP_CACHE_MAX_ITEMS',
+    None)
+
+# unread/unrejected request counters are recounted from MongoDB at least
+# this often (seconds), unless FRIENDSHIP_CACHE_TIMEOUTS says otherwise
+REQUEST_COUNT_TIMEOUT = getattr(
+    settings,
+    'FRIENDSHIP_REQUEST_COUNT_TIMEOUT',
+    300)
+
+# how many of the newest friends/followers are cached for
+# `recent_friends` and `new_followers`
+RECENT_CACHE_SIZE = getattr(
+    settings,
+    'FRIENDSHIP_RECENT_CACHE_SIZE',
+    50)
+
+# maintain a RelationshipSummary document per user on every change,
+# otherwise summaries are computed from relationships on cache misses
+USE_SUMMARY = getattr(
+    settings,
+    'FRIENDSHIP_USE_SUMMARY',
+    False)
+
+# how many of the newest friend/follower ids a summary holds
+SUMMARY_SIZE = getattr(
+    settings,
+    'FRIENDSHIP_SUMMARY_SIZE',
+    20)
+
+# stored summaries are rebuilt from relationships after this many seconds,
+# which reconciles any drift (None - never)
+SUMMARY_MAX_AGE = getattr(
+    settings,
+    'FRIENDSHIP_SUMMARY_MAX_AGE',
+    60 * 60 * 24)
+
+# declare shard keys (the owner of every relationship) and split queries
+# so each of them targets a single shard, see README
+SHARDING = getattr(
+    settings,
+    'FRIENDSHIP_SHARDING',
+    False)
+
+# how many newest requests `inbox` returns by default
+INBOX_SIZE = getattr(
+    settings,
+    'FRIENDSHIP_INBOX_SIZE',
+    50)
+
+# user fields embedded into requests returned by `inbox`
+INBOX_SENDER_FIELDS = getattr(
+    settings,
+    'FRIENDSHIP_INBOX_SENDER_FIELDS',
+    ('username', 'first_name', 'last_name', 'avatar'))
+
+# users with at least this many followers are hot accounts: their full
+# follower lists aren't cached, see `follower_page` (None - never)
+HOT_ACCOUNT_FOLLOWERS = getattr(
+    settings,
+    'FRIENDSHIP_HOT_ACCOUNT_FOLLOWERS',
+    None)
+
+# followers per cached `follower_page`
+FOLLOWER_PAGE_SIZE = getattr(
+    settings,
+    'FRIENDSHIP_FOLLOWER_PAGE_SIZE',
+    500)
+
+# follower pages and approximate follower counts aren't busted on every
+# follow, they expire after this many seconds
+FOLLOWER_PAGE_TIMEOUT = getattr(
+    settings,
+    'FRIENDSHIP_FOLLOWER_PAGE_TIMEOUT',
+    300)
@@ -13,3 +13,4 @@ inspirations_created = Signal(providing_args=['user'])
 inspirations_removed = Signal(providing_args=['user'])
 inspirationals_created = Signal(providing_args=['inspired_by'])
 inspirationals_removed = Signal(providing_args=['inspired_by'])
+friendship_batch_flushed = Signal(providing_args=['signals'])
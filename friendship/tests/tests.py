@@ -1,13 +1,27 @@
+from datetime import datetime, timedelta
+from unittest import skipIf
+
+from bson.binary import Binary
+
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.six import StringIO
+from django.utils.six.moves import cPickle as pickle
 #from django.db import IntegrityError
 
 from mongoengine.django.tests import MongoTestCase
 from mongoengine.errors import NotUniqueError
 
 from friendship.compat import get_user_model
-from friendship.exceptions import AlreadyExistsError
-from friendship.models import Friend, Inspiration, Blocking, FriendshipRequest
+from friendship import analytics, consistency, models, notifications, outbox
+from friendship.serializers import CompactSerializer, PickleSerializer
+from friendship.exceptions import AlreadyExistsError, RateLimitExceeded
+from friendship.models import (Friend, Inspiration, Blocking, FriendshipRequest,
+    RelationshipSummary)
+from friendship.tests.utils import (monitoring, install_recorder,
+    targets_single_shard, explain_targets_single_shard, CacheRecorder, measure)
 
 
 class login(object):
@@ -351,3 +365,1260 @@ class FriendshipModelTests(BaseTestCase):
 
         with self.assertRaises(ValidationError):
             Inspiration.objects.create(user=self.user_bob, inspired_by=self.user_bob)
+
+
+class FriendshipGraphTests(BaseTestCase):
+
+    def make_friends(self, user1, user2):
+        Friend.objects.add_friend(user1, user2).accept()
+
+    def test_degree_of_separation(self):
+        # bob - steve - susan, amy is alone
+        self.make_friends(self.user_bob, self.user_steve)
+        self.make_friends(self.user_steve, self.user_susan)
+
+        self.assertEqual(Friend.objects.degree_of_separation(self.user_bob, self.user_bob), 0)
+        self.assertEqual(Friend.objects.degree_of_separation(self.user_bob, self.user_steve), 1)
+        self.assertEqual(Friend.objects.degree_of_separation(self.user_bob, self.user_susan), 2)
+        self.assertEqual(Friend.objects.degree_of_separation(self.user_susan, self.user_bob), 2)
+        self.assertIsNone(Friend.objects.degree_of_separation(self.user_bob, self.user_amy))
+
+        # susan is out of reach when only direct friends are looked up
+        self.assertIsNone(
+            Friend.objects.degree_of_separation(self.user_bob, self.user_susan, max_depth=1))
+
+    def test_separation_follows_friendship_changes(self):
+        self.make_friends(self.user_bob, self.user_steve)
+        self.assertEqual(Friend.objects.degree_of_separation(self.user_bob, self.user_steve), 1)
+        self.assertIsNone(Friend.objects.degree_of_separation(self.user_bob, self.user_amy))
+
+        Friend.objects.remove_friend(self.user_bob, self.user_steve)
+        self.make_friends(self.user_bob, self.user_amy)
+        self.assertIsNone(Friend.objects.degree_of_separation(self.user_bob, self.user_steve))
+        self.assertEqual(Friend.objects.degree_of_separation(self.user_bob, self.user_amy), 1)
+
+        Friend.objects.remove_all_friends(self.user_amy)
+        self.assertIsNone(Friend.objects.degree_of_separation(self.user_bob, self.user_amy))
+
+    def test_connection_path(self):
+        self.make_friends(self.user_bob, self.user_steve)
+        self.make_friends(self.user_steve, self.user_susan)
+        self.make_friends(self.user_susan, self.user_amy)
+
+        self.assertEqual(
+            Friend.objects.connection_path(self.user_bob, self.user_amy),
+            [self.user_bob, self.user_steve, self.user_susan, self.user_amy])
+        self.assertEqual(
+            Friend.objects.connection_path(self.user_amy, self.user_bob),
+            [self.user_amy, self.user_susan, self.user_steve, self.user_bob])
+        self.assertEqual(
+            Friend.objects.connection_path(self.user_bob, self.user_amy, max_depth=2), [])
+
+
+class StreamingTests(BaseTestCase):
+
+    def setUp(self):
+        super(StreamingTests, self).setUp()
+        self.followers = [self.user_bob, self.user_susan, self.user_amy]
+        for user in self.followers:
+            Inspiration.objects.add_inspiration(user, self.user_steve)
+
+    def test_iter_follower_ids(self):
+        rows = list(Inspiration.objects.iter_follower_ids(self.user_steve, batch_size=2))
+        self.assertEqual([pk for _, pk in rows], [u.pk for u in self.followers])
+
+        # resume after the first follower
+        checkpoint = rows[0][0]
+        resumed = Inspiration.objects.iter_follower_ids(self.user_steve, after=checkpoint)
+        self.assertEqual([pk for _, pk in resumed], [u.pk for u in self.followers[1:]])
+
+    def test_follower_id_ranges(self):
+        ranges = Inspiration.objects.follower_id_ranges(self.user_steve, 2)
+        self.assertEqual(len(ranges), 2)
+
+        seen = []
+        for after, until in ranges:
+            seen.extend(pk for _, pk in Inspiration.objects.iter_follower_ids(
+                self.user_steve, after=after, until=until))
+        self.assertEqual(seen, [u.pk for u in self.followers])
+
+
+class CleanupRequestsTests(BaseTestCase):
+
+    def test_cleanup_friendship_requests(self):
+        old = timezone.now() - timedelta(days=30)
+
+        # rejected long ago
+        req1 = Friend.objects.add_friend(self.user_bob, self.user_steve)
+        req1.reject()
+        FriendshipRequest.objects(id=req1.id).update(set__rejected=old)
+
+        # never answered
+        req2 = Friend.objects.add_friend(self.user_susan, self.user_steve)
+        FriendshipRequest.objects(id=req2.id).update(set__created=old)
+
+        # fresh one
+        Friend.objects.add_friend(self.user_amy, self.user_steve)
+        self.assertEqual(len(Friend.objects.requests(self.user_steve)), 3)
+
+        call_command('cleanup_friendship_requests', rejected_ttl=3600, stdout=StringIO())
+        self.assertEqual(len(Friend.objects.requests(self.user_steve)), 2)
+
+        call_command('cleanup_friendship_requests', pending_ttl=3600, stdout=StringIO())
+        self.assertEqual(Friend.objects.requests(self.user_steve),
+                         list(FriendshipRequest.objects.filter(from_user=self.user_amy)))
+        self.assertEqual(Friend.objects.sent_requests(self.user_susan), [])
+
+
+class RateLimitTests(BaseTestCase):
+
+    def setUp(self):
+        super(RateLimitTests, self).setUp()
+        models.RATE_LIMITS['add_friend'] = (2, 3600)
+        models.RATE_LIMITS['add_inspiration'] = (1, 3600)
+
+    def tearDown(self):
+        models.RATE_LIMITS.pop('add_friend', None)
+        models.RATE_LIMITS.pop('add_inspiration', None)
+        super(RateLimitTests, self).tearDown()
+
+    def test_add_friend_rate_limit(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve)
+        Friend.objects.add_friend(self.user_bob, self.user_susan)
+
+        with self.assertRaises(RateLimitExceeded):
+            Friend.objects.add_friend(self.user_bob, self.user_amy)
+        self.assertEqual(FriendshipRequest.objects.filter(from_user=self.user_bob).count(), 2)
+
+        # other users have their own limits
+        Friend.objects.add_friend(self.user_amy, self.user_bob)
+
+    def test_add_inspiration_rate_limit(self):
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_steve)
+
+        with self.assertRaises(RateLimitExceeded):
+            Inspiration.objects.add_inspiration(self.user_bob, self.user_susan)
+        self.assertEqual(Inspiration.objects.user_inspired_by(self.user_bob), [self.user_steve])
+
+
+class OutboxTests(BaseTestCase):
+
+    def setUp(self):
+        super(OutboxTests, self).setUp()
+        outbox.USE_OUTBOX = True
+        outbox.RelationshipEvent.drop_collection()
+        outbox.OutboxCheckpoint.drop_collection()
+
+    def tearDown(self):
+        outbox.USE_OUTBOX = False
+        outbox.RelationshipEvent.drop_collection()
+        outbox.OutboxCheckpoint.drop_collection()
+        super(OutboxTests, self).tearDown()
+
+    def test_events_are_recorded(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve).accept()
+        Friend.objects.remove_friend(self.user_bob, self.user_steve)
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_steve)
+
+        kinds = [e.kind for e in outbox.RelationshipEvent.objects.order_by('id')]
+        self.assertEqual(kinds, [
+            'friendship_request_created',
+            'friendship_request_accepted',
+            'friendship_removed',
+            'friendship_removed',
+            'inspiration_created',
+        ])
+
+    def test_consumer_checkpoints(self):
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_steve)
+        Inspiration.objects.add_inspiration(self.user_susan, self.user_steve)
+        Inspiration.objects.add_inspiration(self.user_amy, self.user_steve)
+
+        consumer = outbox.OutboxConsumer('feeds', batch_size=2, settle_seconds=0)
+        batches = []
+        self.assertEqual(consumer.consume(batches.append), 2)
+
+        # a failing handler doesn't move the checkpoint
+        def fail(events):
+            raise RuntimeError()
+        with self.assertRaises(RuntimeError):
+            consumer.consume(fail)
+
+        self.assertEqual(consumer.consume(batches.append), 1)
+        self.assertEqual(consumer.consume(batches.append), 0)
+        self.assertEqual(
+            [e.from_user for batch in batches for e in batch],
+            [self.user_bob.pk, self.user_susan.pk, self.user_amy.pk])
+
+        # another consumer starts from the beginning
+        other = outbox.OutboxConsumer('search', settle_seconds=0)
+        self.assertEqual(other.consume_all(lambda events: None), 3)
+
+
+class BatchTests(BaseTestCase):
+
+    def test_batch_defers_signals(self):
+        from friendship import batch
+        from friendship.signals import friendship_request_rejected, friendship_batch_flushed
+
+        rejected, flushed = [], []
+
+        def on_rejected(sender, **kwargs):
+            rejected.append(sender)
+
+        def on_flushed(sender, signals, **kwargs):
+            flushed.append(signals)
+
+        friendship_request_rejected.connect(on_rejected)
+        friendship_batch_flushed.connect(on_flushed)
+        try:
+            req = Friend.objects.add_friend(self.user_bob, self.user_steve)
+            self.assertEqual(len(Friend.objects.rejected_requests(self.user_steve)), 0)
+
+            with batch():
+                req.reject()
+                req.reject()
+                self.assertEqual(rejected, [])
+                # the cache is busted on exit only
+                self.assertEqual(len(Friend.objects.rejected_requests(self.user_steve)), 0)
+
+            self.assertEqual(rejected, [req])
+            self.assertEqual(len(flushed), 1)
+            self.assertEqual(len(Friend.objects.rejected_requests(self.user_steve)), 1)
+        finally:
+            friendship_request_rejected.disconnect(on_rejected)
+            friendship_batch_flushed.disconnect(on_flushed)
+
+
+class RemoveFriendTests(BaseTestCase):
+
+    def test_remove_friend_signals(self):
+        from friendship.signals import friendship_removed
+
+        removed = []
+
+        def on_removed(sender, from_user, to_user, **kwargs):
+            removed.append((from_user, to_user))
+
+        Friend.objects.add_friend(self.user_bob, self.user_steve).accept()
+        friendship_removed.connect(on_removed)
+        try:
+            self.assertTrue(Friend.objects.remove_friend(self.user_steve, self.user_bob))
+        finally:
+            friendship_removed.disconnect(on_removed)
+
+        self.assertEqual(removed, [(self.user_bob, self.user_steve),
+                                   (self.user_steve, self.user_bob)])
+        self.assertEqual(Friend.objects.count(), 0)
+
+    def test_remove_broken_friendship(self):
+        from friendship.signals import friendship_removed
+
+        removed = []
+
+        def on_removed(sender, from_user, to_user, **kwargs):
+            removed.append((from_user, to_user))
+
+        # only the steve -> bob edge exists
+        Friend.objects.create(from_user=self.user_steve, to_user=self.user_bob)
+        friendship_removed.connect(on_removed)
+        try:
+            self.assertTrue(Friend.objects.remove_friend(self.user_steve, self.user_bob))
+        finally:
+            friendship_removed.disconnect(on_removed)
+
+        self.assertEqual(removed, [(self.user_steve, self.user_bob)])
+        self.assertEqual(Friend.objects.count(), 0)
+
+    def test_remove_all_friends(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve).accept()
+        Friend.objects.add_friend(self.user_susan, self.user_bob).accept()
+        Friend.objects.add_friend(self.user_susan, self.user_amy).accept()
+
+        # warm up caches
+        self.assertEqual(len(Friend.objects.friends(self.user_susan)), 2)
+
+        self.assertEqual(Friend.objects.remove_all_friends(self.user_bob), 2)
+        self.assertEqual(Friend.objects.friends(self.user_bob), [])
+        self.assertEqual(Friend.objects.friends(self.user_steve), [])
+        self.assertEqual(Friend.objects.friends(self.user_susan), [self.user_amy])
+
+        self.assertEqual(Friend.objects.remove_all_friends(self.user_bob), 0)
+
+
+class WarmCachesTests(BaseTestCase):
+
+    def test_warm_caches(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve).accept()
+        Friend.objects.add_friend(self.user_susan, self.user_bob)
+        Inspiration.objects.add_inspiration(self.user_amy, self.user_bob)
+        Blocking.objects.add_blocking(self.user_bob, self.user_amy)
+        cache.clear()
+
+        self.assertEqual(models.warm_caches([self.user_bob.pk, self.user_amy.pk]), 14)
+
+        def cached(kind, user):
+            return models.cache_get(kind, user.pk)
+
+        self.assertEqual(cached('friends', self.user_bob), [self.user_steve])
+        self.assertEqual(cached('requests', self.user_bob),
+                         list(FriendshipRequest.objects.filter(to_user=self.user_bob)))
+        self.assertEqual(models.counter_get('unread_request_count', self.user_bob.pk), 1)
+        self.assertEqual(cached('inspirations', self.user_bob), [self.user_amy])
+        self.assertEqual(cached('inspirationals', self.user_amy), [self.user_bob])
+        self.assertEqual(cached('blocked', self.user_bob), [self.user_amy])
+        self.assertEqual(cached('blocked_by', self.user_amy), [self.user_bob])
+        self.assertEqual(cached('friends', self.user_amy), [])
+        self.assertIsNone(cached('friends', self.user_steve))
+
+
+class CompactSerializerTests(BaseTestCase):
+
+    def test_round_trip(self):
+        serializer = CompactSerializer(compress_threshold=None)
+        req = Friend.objects.add_friend(self.user_bob, self.user_steve)
+        requests = list(FriendshipRequest.objects.filter(
+            to_user=self.user_steve).select_related(max_depth=2))
+        users = [self.user_bob, self.user_steve]
+
+        for value in (0, 42, [], users, [u.pk for u in users], [{'id': 1}]):
+            self.assertEqual(serializer.loads(serializer.dumps(value)), value)
+
+        loaded = serializer.loads(serializer.dumps(requests))
+        self.assertEqual(loaded, [req])
+        # referenced users are restored without queries
+        self.assertEqual(loaded[0]._data['from_user'].email, self.user_bob.email)
+
+    def test_compression(self):
+        users = [self.user_bob, self.user_steve, self.user_susan, self.user_amy] * 50
+        plain = CompactSerializer(compress_threshold=None).dumps(users)
+        compressed = CompactSerializer(compress_threshold=100).dumps(users)
+        self.assertLess(len(compressed), len(plain))
+        self.assertEqual(CompactSerializer().loads(compressed), users)
+
+    def test_compact_data_is_a_miss_after_rollback(self):
+        data = CompactSerializer().dumps([self.user_bob])
+        self.assertIsNone(PickleSerializer().loads(data))
+        self.assertEqual(PickleSerializer().loads([self.user_bob]), [self.user_bob])
+
+    def test_unknown_data_is_a_miss(self):
+        serializer = CompactSerializer()
+        data = serializer.dumps([self.user_bob])
+
+        self.assertIsNone(serializer.loads([self.user_bob]))
+        self.assertIsNone(serializer.loads(b'XX' + data[2:]))
+        self.assertIsNone(serializer.loads(data[:2] + b'\x63' + data[3:]))
+
+
+class CachePolicyTests(BaseTestCase):
+
+    def test_timeout_jitter(self):
+        models.CACHE_TIMEOUTS['friends'] = 1000
+        try:
+            for _ in range(20):
+                timeout = models.cache_timeout('friends')
+                self.assertTrue(1000 <= timeout <= 1000 * (1 + models.CACHE_TIMEOUT_JITTER))
+        finally:
+            del models.CACHE_TIMEOUTS['friends']
+
+    def test_set_many_spreads_timeouts(self):
+        timeouts = set()
+        real_set_many = models.cache.set_many
+
+        def set_many(data, timeout=None):
+            timeouts.update([timeout] * len(data))
+            return real_set_many(data, timeout)
+
+        models.CACHE_TIMEOUTS['friends'] = 1000
+        models.cache.set_many = set_many
+        try:
+            models.cache_set_many(dict((('friends', pk), []) for pk in range(100)))
+        finally:
+            del models.cache.set_many
+            del models.CACHE_TIMEOUTS['friends']
+
+        self.assertTrue(1 < len(timeouts) <= models.TIMEOUT_BUCKETS)
+        for timeout in timeouts:
+            self.assertTrue(1000 <= timeout <= 1000 * (1 + models.CACHE_TIMEOUT_JITTER))
+
+    def test_oversized_lists_are_not_cached(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve).accept()
+        Friend.objects.add_friend(self.user_bob, self.user_susan).accept()
+
+        models.CACHE_MAX_ITEMS = 1
+        try:
+            self.assertEqual(len(Friend.objects.friends(self.user_bob)), 2)
+            self.assertIsNone(models.cache_get('friends', self.user_bob.pk))
+
+            self.assertEqual(Friend.objects.friends(self.user_steve), [self.user_bob])
+            self.assertEqual(models.cache_get('friends', self.user_steve.pk), [self.user_bob])
+        finally:
+            models.CACHE_MAX_ITEMS = None
+
+
+class ReverseBlockingTests(BaseTestCase):
+
+    def setUp(self):
+        super(ReverseBlockingTests, self).setUp()
+        Blocking.drop_collection()
+        # steve blocked bob, bob blocked amy
+        Blocking.objects.add_blocking(self.user_steve, self.user_bob)
+        Blocking.objects.add_blocking(self.user_bob, self.user_amy)
+
+    def test_blocked_by(self):
+        self.assertEqual(Blocking.objects.blocked_by(self.user_bob), [self.user_steve])
+        self.assertEqual(Blocking.objects.blocked_by(self.user_amy), [self.user_bob])
+        self.assertEqual(Blocking.objects.blocked_by(self.user_steve), [])
+
+        Blocking.objects.remove_blocking(self.user_steve, self.user_bob)
+        self.assertEqual(Blocking.objects.blocked_by(self.user_bob), [])
+
+    def test_is_blocked_either_way(self):
+        for warm in (False, True):
+            if warm:
+                for user in (self.user_bob, self.user_steve, self.user_amy):
+                    Blocking.objects.blocked_for_user(user)
+                    Blocking.objects.blocked_by(user)
+
+            self.assertTrue(Blocking.objects.is_blocked_either_way(self.user_bob, self.user_steve))
+            self.assertTrue(Blocking.objects.is_blocked_either_way(self.user_steve, self.user_bob))
+            self.assertTrue(Blocking.objects.is_blocked_either_way(self.user_amy, self.user_bob))
+            self.assertFalse(Blocking.objects.is_blocked_either_way(self.user_amy, self.user_steve))
+            self.assertFalse(Blocking.objects.is_blocked_either_way(self.user_susan, self.user_bob))
+
+    def test_filter_blocked(self):
+        users = [self.user_steve, self.user_susan, self.user_amy]
+        self.assertEqual(Blocking.objects.filter_blocked(self.user_bob, users), [self.user_susan])
+
+        # from warm caches
+        Blocking.objects.blocked_for_user(self.user_bob)
+        Blocking.objects.blocked_by(self.user_bob)
+        self.assertEqual(Blocking.objects.filter_blocked(self.user_bob, users), [self.user_susan])
+
+        self.assertEqual(Blocking.objects.filter_blocked(self.user_susan, users), users)
+
+
+class FriendTagsTests(BaseTestCase):
+
+    def setUp(self):
+        super(FriendTagsTests, self).setUp()
+        for user in (self.user_steve, self.user_susan, self.user_amy):
+            Friend.objects.add_friend(self.user_bob, user).accept()
+
+    def test_tags(self):
+        self.assertEqual(Friend.objects.friends(self.user_bob, tag='close'), [])
+
+        self.assertEqual(Friend.objects.tag_friends(
+            self.user_bob, [self.user_steve, self.user_amy], 'close'), 2)
+        Friend.objects.tag_friends(self.user_bob, [self.user_susan], 'coworkers')
+
+        self.assertEqual(Friend.objects.friends(self.user_bob, tag='close'),
+                         [self.user_steve, self.user_amy])
+        self.assertEqual(Friend.objects.friends(self.user_bob, tag='coworkers'),
+                         [self.user_susan])
+        # tags are per side of the friendship
+        self.assertEqual(Friend.objects.friends(self.user_steve, tag='close'), [])
+
+        self.assertEqual(Friend.objects.untag_friends(
+            self.user_bob, 'close', [self.user_amy]), 1)
+        self.assertEqual(Friend.objects.friends(self.user_bob, tag='close'), [self.user_steve])
+
+        # removing a friend invalidates tagged lists as well
+        Friend.objects.remove_friend(self.user_bob, self.user_steve)
+        self.assertEqual(Friend.objects.friends(self.user_bob, tag='close'), [])
+
+        Friend.objects.untag_friends(self.user_bob, 'coworkers')
+        self.assertEqual(Friend.objects.friends(self.user_bob, tag='coworkers'), [])
+
+    def test_empty_tag(self):
+        with self.assertRaises(ValidationError):
+            Friend.objects.tag_friends(self.user_bob, [self.user_steve], '')
+
+
+class InspiredMapTests(BaseTestCase):
+
+    def setUp(self):
+        super(InspiredMapTests, self).setUp()
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_steve)
+        Inspiration.objects.add_inspiration(self.user_susan, self.user_bob)
+        self.others = [self.user_steve, self.user_susan, self.user_amy]
+
+    def test_inspired_map(self):
+        expected = {
+            self.user_steve.pk: True,
+            self.user_susan.pk: False,
+            self.user_amy.pk: False,
+        }
+        # nothing cached
+        self.assertEqual(Inspiration.objects.inspired_map(self.user_bob, self.others), expected)
+
+        # follower lists of the targets aren't read
+        for user in self.others:
+            Inspiration.objects.inspired_by_user(user)
+        Inspiration.objects.create(user=self.user_bob, inspired_by=self.user_amy)
+        expected[self.user_amy.pk] = True
+        self.assertEqual(Inspiration.objects.inspired_map(self.user_bob, self.others), expected)
+
+        # from the user's own list
+        Inspiration.objects.user_inspired_by(self.user_bob)
+        self.assertEqual(Inspiration.objects.inspired_map(self.user_bob, self.others), expected)
+
+        self.assertEqual(Inspiration.objects.inspired_map(self.user_bob, []), {})
+
+    def test_followers_among(self):
+        self.assertEqual(
+            Inspiration.objects.followers_among(self.user_bob, self.others),
+            [self.user_susan])
+
+        # from the following lists of the candidates
+        for user in self.others:
+            Inspiration.objects.user_inspired_by(user)
+        self.assertEqual(
+            Inspiration.objects.followers_among(self.user_bob, self.others),
+            [self.user_susan])
+
+    def test_cached_lists_are_trusted(self):
+        Inspiration.objects.user_inspired_by(self.user_bob)
+        # bypasses the manager, so caches don't know about it
+        Inspiration.objects.create(user=self.user_bob, inspired_by=self.user_amy)
+        self.assertFalse(Inspiration.objects.is_inspired(self.user_bob, self.user_amy))
+
+
+class GraphConsistencyTests(BaseTestCase):
+
+    def break_graph(self):
+        # accept interrupted after the first edge
+        Friend.objects.add_friend(self.user_bob, self.user_steve)
+        Friend.objects.create(from_user=self.user_bob, to_user=self.user_steve)
+        # Friend.save() refuses self-edges
+        Friend._get_collection().insert(
+            {'from_user': self.user_amy.pk, 'to_user': self.user_amy.pk})
+        # a friend deleted without cleaning up
+        Friend.objects.add_friend(self.user_susan, self.user_amy).accept()
+        self.User._get_collection().remove({'_id': self.user_susan.pk})
+
+    def test_check_and_repair(self):
+        self.break_graph()
+        self.assertEqual(Friend.objects.friends(self.user_steve), [])
+
+        result = consistency.check_range()
+        self.assertEqual(result['scanned'], 4)
+        self.assertEqual(result['one_directional'], [(self.user_bob.pk, self.user_steve.pk)])
+        self.assertEqual(len(result['self_edges']), 1)
+        self.assertEqual(len(result['dangling']), 2)
+        self.assertEqual(len(result['stale_requests']), 1)
+
+        affected = consistency.repair(result)
+        consistency.bust_repaired(affected)
+
+        self.assertEqual(Friend.objects.friends(self.user_steve), [self.user_bob])
+        self.assertEqual(Friend.objects.friends(self.user_amy), [])
+        self.assertEqual(Friend.objects.requests(self.user_steve), [])
+
+        result = consistency.check_range()
+        self.assertEqual(result['scanned'], 2)
+        for issue in consistency.ISSUES:
+            self.assertEqual(result[issue], [])
+
+    def test_command(self):
+        self.break_graph()
+
+        out = StringIO()
+        call_command('check_friendship_graph', workers=1, stdout=out)
+        self.assertIn('one_directional: 1', out.getvalue())
+        self.assertFalse(Friend.objects.are_friends(self.user_bob, self.user_steve))
+
+        call_command('check_friendship_graph', repair=True, workers=2,
+                     chunk_size=1, stdout=StringIO())
+        self.assertTrue(Friend.objects.are_friends(self.user_bob, self.user_steve))
+
+        out = StringIO()
+        call_command('check_friendship_graph', workers=1, stdout=out)
+        self.assertIn('one_directional: 0', out.getvalue())
+
+
+class RequestCountersTests(BaseTestCase):
+
+    def counters(self, user):
+        return (models.counter_get('unread_request_count', user.pk),
+                models.counter_get('unrejected_request_count', user.pk))
+
+    def test_counters_follow_transitions(self):
+        self.assertEqual(Friend.objects.unread_request_count(self.user_steve), 0)
+        self.assertEqual(Friend.objects.unrejected_request_count(self.user_steve), 0)
+
+        req1 = Friend.objects.add_friend(self.user_bob, self.user_steve)
+        req2 = Friend.objects.add_friend(self.user_susan, self.user_steve)
+        req3 = Friend.objects.add_friend(self.user_amy, self.user_steve)
+        self.assertEqual(self.counters(self.user_steve), (3, 3))
+
+        req1.mark_viewed()
+        req1.mark_viewed()
+        self.assertEqual(self.counters(self.user_steve), (2, 3))
+
+        req2.reject()
+        self.assertEqual(self.counters(self.user_steve), (2, 2))
+
+        req3.cancel()
+        self.assertEqual(self.counters(self.user_steve), (1, 1))
+
+        req1.accept()
+        # counters dropping to 0 are recounted, memcached can't go below 0
+        self.assertEqual(self.counters(self.user_steve), (1, None))
+
+        self.assertEqual(Friend.objects.unread_request_count(self.user_steve), 1)
+        self.assertEqual(Friend.objects.unrejected_request_count(self.user_steve), 0)
+
+    def test_repeated_transitions_are_counted_once(self):
+        req1 = Friend.objects.add_friend(self.user_bob, self.user_steve)
+        req2 = Friend.objects.add_friend(self.user_susan, self.user_steve)
+        Friend.objects.add_friend(self.user_amy, self.user_steve)
+        self.assertEqual(Friend.objects.unread_request_count(self.user_steve), 3)
+        self.assertEqual(Friend.objects.unrejected_request_count(self.user_steve), 3)
+
+        req1.cancel()
+        req1.cancel()
+        req2.accept()
+        req2.cancel()
+        self.assertEqual(self.counters(self.user_steve), (1, 1))
+        self.assertEqual(Friend.objects.unread_request_count(self.user_steve), 1)
+        self.assertEqual(Friend.objects.unrejected_request_count(self.user_steve), 1)
+
+    def test_drift_to_zero_is_recounted(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve)
+        self.assertEqual(Friend.objects.unread_request_count(self.user_steve), 1)
+
+        # behind the managers' back
+        FriendshipRequest.objects.create(from_user=self.user_susan, to_user=self.user_steve)
+        models.counter_incr('unread_request_count', self.user_steve.pk, -1)
+
+        self.assertIsNone(models.counter_get('unread_request_count', self.user_steve.pk))
+        self.assertEqual(Friend.objects.unread_request_count(self.user_steve), 2)
+
+    def test_reconcile(self):
+        Friend.objects.unread_request_count(self.user_steve)
+        Friend.objects.unrejected_request_count(self.user_steve)
+
+        # behind the managers' back
+        FriendshipRequest.objects.create(from_user=self.user_bob, to_user=self.user_steve)
+        self.assertEqual(Friend.objects.unread_request_count(self.user_steve), 0)
+
+        self.assertEqual(Friend.objects.reconcile_request_counts(self.user_steve), (1, 1))
+        self.assertEqual(Friend.objects.unread_request_count(self.user_steve), 1)
+
+    def test_missing_counters_are_not_created(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve)
+        self.assertEqual(self.counters(self.user_steve), (None, None))
+        self.assertEqual(Friend.objects.unrejected_request_count(self.user_steve), 1)
+
+
+class RecentRelationshipsTests(BaseTestCase):
+
+    def test_recent_friends(self):
+        now = timezone.now()
+        week_ago = now - timedelta(days=7)
+        for days, user in ((8, self.user_steve), (2, self.user_susan), (1, self.user_amy)):
+            Friend.objects.add_friend(self.user_bob, user).accept()
+            Friend.objects.filter(from_user=self.user_bob, to_user=user)\
+                .update(set__created=now - timedelta(days=days))
+
+        self.assertEqual(Friend.objects.recent_friends(self.user_bob),
+                         [self.user_amy, self.user_susan, self.user_steve])
+        self.assertEqual(Friend.objects.recent_friends(self.user_bob, since=week_ago),
+                         [self.user_amy, self.user_susan])
+        self.assertEqual(Friend.objects.recent_friends(self.user_bob, limit=1),
+                         [self.user_amy])
+
+        # aware datetimes compare with the naive ones pymongo returns
+        aware_week_ago = (datetime.utcnow() - timedelta(days=7)).replace(tzinfo=timezone.utc)
+        self.assertEqual(Friend.objects.recent_friends(self.user_bob, since=aware_week_ago),
+                         [self.user_amy, self.user_susan])
+
+        Friend.objects.remove_friend(self.user_bob, self.user_amy)
+        self.assertEqual(Friend.objects.recent_friends(self.user_bob, since=week_ago),
+                         [self.user_susan])
+
+    def test_beyond_cached_newest(self):
+        now = timezone.now()
+        for days, user in ((3, self.user_steve), (2, self.user_susan), (1, self.user_amy)):
+            Inspiration.objects.add_inspiration(user, self.user_bob)
+            Inspiration.objects.filter(user=user, inspired_by=self.user_bob)\
+                .update(set__created=now - timedelta(days=days))
+
+        size = models.RECENT_CACHE_SIZE
+        models.RECENT_CACHE_SIZE = 2
+        try:
+            # bounded by the cache size unless asked for more
+            self.assertEqual(Inspiration.objects.new_followers(self.user_bob),
+                             [self.user_amy, self.user_susan])
+            self.assertEqual(Inspiration.objects.new_followers(self.user_bob, limit=3),
+                             [self.user_amy, self.user_susan, self.user_steve])
+            self.assertEqual(len(models.cache_get('new_followers', self.user_bob.pk)), 2)
+            self.assertEqual(Inspiration.objects.new_followers(self.user_bob, limit=2),
+                             [self.user_amy, self.user_susan])
+        finally:
+            models.RECENT_CACHE_SIZE = size
+
+        Inspiration.objects.remove_inspiration(self.user_amy, self.user_bob)
+        self.assertEqual(Inspiration.objects.new_followers(self.user_bob, limit=1),
+                         [self.user_susan])
+
+
+class LoadTestTests(BaseTestCase):
+
+    def test_load_test_friendship(self):
+        users = self.User.objects.count()
+
+        out = StringIO()
+        call_command('load_test_friendship', force=True, users=4, processes=1,
+                     threads=2, operations=10, stdout=out, stderr=StringIO())
+        self.assertIn('20 operations', out.getvalue())
+        self.assertIn('one_directional:', out.getvalue())
+
+        # synthetic users are gone with their relationships
+        self.assertEqual(self.User.objects.count(), users)
+        self.assertEqual(Friend.objects.count(), 0)
+        self.assertEqual(FriendshipRequest.objects.count(), 0)
+
+
+class RecordingNotifier(notifications.BaseNotifier):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, users, label, extra_context=None):
+        self.sent.extend((user, label) for user in users)
+
+
+class NotifierTests(BaseTestCase):
+
+    def setUp(self):
+        super(NotifierTests, self).setUp()
+        self.previous = notifications._notifier
+        self.notifier = notifications._notifier = RecordingNotifier()
+
+    def tearDown(self):
+        notifications._notifier = self.previous
+        super(NotifierTests, self).tearDown()
+
+    def test_notifications(self):
+        req = Friend.objects.add_friend(self.user_bob, self.user_steve)
+        self.assertEqual(self.notifier.sent, [
+            (self.user_steve, "friendship_request"),
+            (self.user_bob, "friendship_request_sent"),
+        ])
+
+        del self.notifier.sent[:]
+        req.accept()
+        self.assertEqual(self.notifier.sent, [
+            (self.user_steve, "friendship_accept_sent"),
+            (self.user_bob, "friendship_accept"),
+        ])
+
+    def test_default_notifier(self):
+        notifications._notifier = None
+        self.assertIsInstance(notifications.get_notifier(), notifications.BaseNotifier)
+        self.assertIs(notifications.get_notifier(), notifications.get_notifier())
+
+    def test_null_notifier_loads_nothing(self):
+        class Untouchable(object):
+            def __getattr__(self, name):
+                raise AssertionError("%s was read" % name)
+
+        notifications._notifier = notifications.NullNotifier()
+        notifications.send_request_sent_notification(Untouchable())
+        notifications.send_acceptance_sent_notification(
+            None, from_user=Untouchable(), to_user=Untouchable())
+
+
+class RelationshipSummaryTests(BaseTestCase):
+
+    def setUp(self):
+        super(RelationshipSummaryTests, self).setUp()
+        RelationshipSummary.drop_collection()
+        models.USE_SUMMARY = True
+
+    def tearDown(self):
+        models.USE_SUMMARY = False
+        RelationshipSummary.drop_collection()
+        super(RelationshipSummaryTests, self).tearDown()
+
+    def summary(self, user):
+        return RelationshipSummary.objects.for_user(user)
+
+    def test_maintained_incrementally(self):
+        self.assertEqual(self.summary(self.user_bob)['friends_count'], 0)
+        self.summary(self.user_steve)
+        self.assertEqual(RelationshipSummary.objects.count(), 2)
+
+        req = Friend.objects.add_friend(self.user_steve, self.user_bob)
+        self.assertEqual(self.summary(self.user_bob)['unread_request_count'], 1)
+        req.accept()
+        Inspiration.objects.add_inspiration(self.user_steve, self.user_bob)
+        Blocking.objects.add_blocking(self.user_bob, self.user_amy)
+
+        stored = RelationshipSummary.objects.get(pk=self.user_bob.pk)
+        self.assertEqual(stored.friends_count, 1)
+        self.assertEqual(stored.friend_ids, [self.user_steve.pk])
+        self.assertEqual(stored.follower_ids, [self.user_steve.pk])
+
+        summary = self.summary(self.user_bob)
+        self.assertEqual(summary['friends_count'], 1)
+        self.assertEqual(summary['followers_count'], 1)
+        self.assertEqual(summary['blocked_count'], 1)
+        self.assertEqual(summary['unread_request_count'], 0)
+        self.assertEqual(summary['unrejected_request_count'], 0)
+        self.assertEqual(self.summary(self.user_steve)['following_count'], 1)
+
+        Friend.objects.remove_friend(self.user_bob, self.user_steve)
+        Inspiration.objects.remove_inspiration(self.user_steve, self.user_bob)
+        summary = self.summary(self.user_bob)
+        self.assertEqual(summary['friends_count'], 0)
+        self.assertEqual(summary['friend_ids'], [])
+        self.assertEqual(summary['follower_ids'], [])
+
+    def test_newest_ids_are_bounded(self):
+        size = models.SUMMARY_SIZE
+        models.SUMMARY_SIZE = 2
+        try:
+            self.summary(self.user_bob)
+            for user in (self.user_steve, self.user_susan, self.user_amy):
+                Inspiration.objects.add_inspiration(user, self.user_bob)
+            summary = self.summary(self.user_bob)
+            self.assertEqual(summary['followers_count'], 3)
+            self.assertEqual(summary['follower_ids'], [self.user_amy.pk, self.user_susan.pk])
+
+            # removing one of the newest leaves too few ids, so it's rebuilt
+            Inspiration.objects.remove_inspiration(self.user_amy, self.user_bob)
+            self.assertEqual(len(self.summary(self.user_bob)['follower_ids']), 2)
+        finally:
+            models.SUMMARY_SIZE = size
+
+    def test_rebuild_yields_to_concurrent_changes(self):
+        def changed_meanwhile(document, *args, **kwargs):
+            models.summary_changed(self.user_bob.pk, inc={'friends_count': 1})
+            return super(RelationshipSummary, document).to_mongo(*args, **kwargs)
+
+        # a change lands between counting and storing the rebuilt summary
+        RelationshipSummary.to_mongo = changed_meanwhile
+        try:
+            RelationshipSummary.objects.rebuild(self.user_bob.pk)
+        finally:
+            del RelationshipSummary.to_mongo
+        self.assertFalse(RelationshipSummary.objects.get(pk=self.user_bob.pk).is_complete())
+
+        self.assertEqual(self.summary(self.user_bob)['friends_count'], 0)
+        self.assertTrue(RelationshipSummary.objects.get(pk=self.user_bob.pk).is_complete())
+
+    def test_old_summaries_are_rebuilt(self):
+        self.summary(self.user_bob)
+        # drifted, e.g. by a lost update
+        RelationshipSummary.objects(pk=self.user_bob.pk).update_one(
+            set__followers_count=5,
+            set__rebuilt=datetime.utcnow() - timedelta(seconds=models.SUMMARY_MAX_AGE + 1))
+        cache.clear()
+        self.assertEqual(self.summary(self.user_bob)['followers_count'], 0)
+
+    def test_computed_without_documents(self):
+        models.USE_SUMMARY = False
+        Friend.objects.add_friend(self.user_steve, self.user_bob).accept()
+        self.assertEqual(self.summary(self.user_bob)['friend_ids'], [self.user_steve.pk])
+        Friend.objects.remove_friend(self.user_bob, self.user_steve)
+        self.assertEqual(self.summary(self.user_bob)['friends_count'], 0)
+        self.assertEqual(RelationshipSummary.objects.count(), 0)
+
+
+class AnalyticsTests(BaseTestCase):
+
+    def setUp(self):
+        super(AnalyticsTests, self).setUp()
+        for document in (analytics.AnalyticsRun, analytics.AnalyticsPartition,
+                         analytics.AnalyticsResult):
+            document.drop_collection()
+
+        for user1, user2 in ((self.user_bob, self.user_steve),
+                             (self.user_steve, self.user_susan),
+                             (self.user_susan, self.user_bob),
+                             (self.user_bob, self.user_amy)):
+            Friend.objects.add_friend(user1, user2).accept()
+        for user in (self.user_steve, self.user_susan):
+            Inspiration.objects.add_inspiration(user, self.user_bob)
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_amy)
+
+    def test_jobs(self):
+        degree = analytics.run_job('degree', parts=3, workers=2)
+        self.assertEqual(degree['users'], 4)
+        self.assertEqual(degree['max'], 3)
+        self.assertEqual(degree['histogram'], {'1': 1, '2': 2, '3': 1})
+
+        clustering = analytics.run_job('clustering', parts=3, workers=2)
+        self.assertEqual(clustering['users'], 3)
+        self.assertAlmostEqual(clustering['average'], 7 / 9.0)
+
+        influencers = analytics.run_job('influencers', parts=2, workers=1, top=1)
+        self.assertEqual(influencers['top'], [{'user': self.user_bob.pk, 'followers': 2}])
+
+        self.assertEqual(analytics.AnalyticsResult.objects.get(pk='degree').result['max'], 3)
+        self.assertEqual(analytics.AnalyticsPartition.objects.count(), 0)
+
+    def test_resume(self):
+        analytics.AnalyticsRun(name='degree', job='degree', options={}, ranges=[
+            {'after': None, 'until': None}]).save()
+        # the only range is checkpointed already, with a made up result
+        analytics.AnalyticsPartition(run='degree', index=0, partial=Binary(
+            pickle.dumps({self.user_bob.pk: 9}))).save()
+
+        self.assertEqual(analytics.run_job('degree', parts=3, workers=1)['max'], 9)
+        # finished runs start over
+        self.assertEqual(analytics.run_job('degree', parts=3, workers=1)['max'], 3)
+
+    def test_large_partials_are_split(self):
+        size = analytics.PARTIAL_CHUNK_SIZE
+        analytics.PARTIAL_CHUNK_SIZE = 16
+        try:
+            analytics.run_partition(('degree', {}, 'split', 0, None, None))
+        finally:
+            analytics.PARTIAL_CHUNK_SIZE = size
+
+        self.assertGreater(analytics.AnalyticsPartition.objects(run='split').count(), 1)
+        self.assertEqual(analytics.load_partial('split', 0),
+                         analytics.DegreeDistribution().map(None, None))
+
+
+@skipIf(monitoring is None, "pymongo >= 3.1 is required to record commands")
+class ShardTargetingTests(BaseTestCase):
+
+    def setUp(self):
+        super(ShardTargetingTests, self).setUp()
+        models.SHARDING = True
+        self.recorder = install_recorder()
+        self.shard_keys = {
+            Friend._get_collection_name(): 'from_user',
+            Blocking._get_collection_name(): 'from_user',
+            Inspiration._get_collection_name(): 'user',
+        }
+
+    def tearDown(self):
+        models.SHARDING = False
+        super(ShardTargetingTests, self).tearDown()
+
+    def assertTargeted(self, func, *args):
+        cache.clear()
+        with self.recorder.record():
+            func(*args)
+
+        for collection, shard_key in self.shard_keys.items():
+            for command_name, query in self.recorder.filters(collection):
+                self.assertTrue(targets_single_shard(query, shard_key),
+                                "%s on %s isn't targeted: %r" % (command_name, collection, query))
+
+    def test_queries_target_single_shard(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve).accept()
+        Blocking.objects.add_blocking(self.user_susan, self.user_amy)
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_amy)
+
+        self.assertTargeted(Friend.objects.friends, self.user_bob)
+        self.assertTargeted(Friend.objects.are_friends, self.user_bob, self.user_steve)
+        self.assertTargeted(Blocking.objects.is_blocked_either_way, self.user_susan, self.user_amy)
+        self.assertTargeted(Blocking.objects.filter_blocked, self.user_amy, [self.user_susan])
+        self.assertTargeted(Inspiration.objects.user_inspired_by, self.user_bob)
+        self.assertTargeted(Friend.objects.remove_friend, self.user_bob, self.user_steve)
+        self.assertFalse(Friend.objects.are_friends(self.user_bob, self.user_steve))
+
+    def test_remove_all_friends(self):
+        # several friends, so `$in` over owners would be caught
+        for friend in (self.user_steve, self.user_susan, self.user_amy):
+            Friend.objects.add_friend(self.user_bob, friend).accept()
+        self.assertTargeted(Friend.objects.remove_all_friends, self.user_bob)
+        self.assertEqual(Friend.objects.count(), 0)
+
+    def test_explain(self):
+        single = explain_targets_single_shard(
+            Friend.objects.filter(from_user=self.user_bob, to_user=self.user_steve))
+        if single is None:
+            self.skipTest("not connected to a sharded cluster")
+        self.assertTrue(single)
+
+
+class InboxTests(BaseTestCase):
+
+    def setUp(self):
+        super(InboxTests, self).setUp()
+        now = timezone.now()
+        self.requests = []
+        for days, user in ((2, self.user_steve), (1, self.user_susan)):
+            req = Friend.objects.add_friend(user, self.user_bob, message='Hi')
+            FriendshipRequest.objects(id=req.id).update(set__created=now - timedelta(days=days))
+            self.requests.append(req)
+
+    def test_inbox(self):
+        inbox = Friend.objects.inbox(self.user_bob)
+        self.assertEqual([r['id'] for r in inbox], [self.requests[1].id, self.requests[0].id])
+        self.assertEqual(inbox[0]['message'], 'Hi')
+        self.assertEqual(inbox[0]['from_user']['id'], self.user_susan.pk)
+        self.assertIn('display_name', inbox[0]['from_user'])
+        # plain data, nothing is dereferenced from the cache
+        self.assertEqual(type(inbox[0]), dict)
+
+        self.assertEqual(len(Friend.objects.inbox(self.user_bob, limit=1)), 1)
+        self.assertEqual(Friend.objects.inbox(self.user_steve), [])
+
+    def test_states(self):
+        self.assertEqual(len(Friend.objects.inbox(self.user_bob, state='unread')), 2)
+        self.assertEqual(len(Friend.objects.inbox(self.user_bob, state='unrejected')), 2)
+
+        self.requests[0].mark_viewed()
+        self.requests[1].reject()
+
+        self.assertEqual([r['id'] for r in Friend.objects.inbox(self.user_bob, state='unread')],
+                         [self.requests[1].id])
+        self.assertEqual([r['id'] for r in Friend.objects.inbox(self.user_bob, state='unrejected')],
+                         [self.requests[0].id])
+        self.assertEqual(len(Friend.objects.inbox(self.user_bob)), 2)
+
+    def test_users_in_another_database(self):
+        # no `$lookup` across databases, senders are queried on their own
+        alias = models.DB_ALIAS
+        models.DB_ALIAS = 'friendship-elsewhere'
+        try:
+            inbox = Friend.objects.inbox(self.user_bob)
+        finally:
+            models.DB_ALIAS = alias
+        self.assertEqual([r['from_user']['id'] for r in inbox],
+                         [self.user_susan.pk, self.user_steve.pk])
+
+
+class HotAccountTests(BaseTestCase):
+
+    def setUp(self):
+        super(HotAccountTests, self).setUp()
+        self.previous = models.HOT_ACCOUNT_FOLLOWERS, models.FOLLOWER_PAGE_SIZE
+        models.HOT_ACCOUNT_FOLLOWERS = 2
+        models.FOLLOWER_PAGE_SIZE = 2
+        for user in (self.user_steve, self.user_susan, self.user_amy):
+            Inspiration.objects.add_inspiration(user, self.user_bob)
+
+    def tearDown(self):
+        models.HOT_ACCOUNT_FOLLOWERS, models.FOLLOWER_PAGE_SIZE = self.previous
+        super(HotAccountTests, self).tearDown()
+
+    def test_follower_lists_not_cached(self):
+        self.assertTrue(Inspiration.objects.is_hot(self.user_bob))
+        # the first page instead of the full list
+        self.assertEqual(Inspiration.objects.inspired_by_user(self.user_bob),
+                         Inspiration.objects.follower_page(self.user_bob))
+        self.assertEqual(len(Inspiration.objects.inspired_by_user(self.user_bob)), 2)
+        self.assertIsNone(models.cache_get('inspirations', self.user_bob.pk))
+
+        Inspiration.objects.inspired_by_user(self.user_steve)
+        self.assertEqual(models.cache_get('inspirations', self.user_steve.pk), [])
+        self.assertFalse(Inspiration.objects.is_hot(self.user_steve))
+
+        self.assertEqual(models.warm_caches([self.user_bob.pk], kinds=('inspirations',)), 0)
+
+    def test_follower_counts(self):
+        # bob's counter is cached, the others are counted
+        self.assertEqual(Inspiration.objects.follower_count(self.user_bob), 3)
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_steve)
+        self.assertEqual(Inspiration.objects.follower_counts(
+            [self.user_bob.pk, self.user_steve.pk, self.user_amy.pk]),
+            {self.user_bob.pk: 3, self.user_steve.pk: 1, self.user_amy.pk: 0})
+        self.assertEqual(models.counter_get('follower_count', self.user_amy.pk), 0)
+
+    def test_warm_caches_skips_hot_accounts(self):
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_steve)
+        self.assertEqual(models.warm_caches(
+            [self.user_bob.pk, self.user_steve.pk], kinds=('inspirations',)), 1)
+        self.assertEqual(models.cache_get('inspirations', self.user_steve.pk), [self.user_bob])
+        self.assertIsNone(models.cache_get('inspirations', self.user_bob.pk))
+
+    def test_follower_count(self):
+        self.assertEqual(Inspiration.objects.follower_count(self.user_bob), 3)
+        # adjusted in place
+        Inspiration.objects.add_inspiration(self.user_bob, self.user_steve)
+        Inspiration.objects.remove_inspiration(self.user_amy, self.user_bob)
+        self.assertEqual(Inspiration.objects.follower_count(self.user_bob), 2)
+        self.assertEqual(Inspiration.objects.follower_count(self.user_steve), 1)
+
+    def test_follower_pages(self):
+        now = timezone.now()
+        for days, user in enumerate((self.user_amy, self.user_susan, self.user_steve)):
+            Inspiration.objects(user=user).update(set__created=now - timedelta(days=days))
+
+        self.assertEqual(Inspiration.objects.follower_page(self.user_bob),
+                         [self.user_amy, self.user_susan])
+        self.assertEqual(Inspiration.objects.follower_page(self.user_bob, 1),
+                         [self.user_steve])
+        self.assertEqual(Inspiration.objects.follower_page(self.user_bob, 2), [])
+
+        # pages aren't busted, they expire
+        Inspiration.objects.remove_inspiration(self.user_amy, self.user_bob)
+        self.assertEqual(Inspiration.objects.follower_page(self.user_bob),
+                         [self.user_amy, self.user_susan])
+
+
+@skipIf(monitoring is None, "pymongo >= 3.1 is required to record commands")
+class QueryBudgetTests(BaseTestCase):
+    """
+    Upper bounds of (Mongo commands, cache operations) per call of every
+    public manager and request method, with cold and with warm caches.
+    Signal receivers are wired as configured, with the notifier resolved
+    when django-notification isn't installed. Lower a budget when a change
+    makes a call cheaper.
+    """
+
+    def setUp(self):
+        super(QueryBudgetTests, self).setUp()
+        self.recorder = install_recorder()
+        self.cache = models.cache = CacheRecorder(models.cache)
+        self.previous_notifier = notifications._notifier
+        notifications._notifier = notifications.NullNotifier()
+        self.user_pks = [u.pk for u in (
+            self.user_bob, self.user_steve, self.user_susan, self.user_amy)]
+        self.populate()
+
+    def tearDown(self):
+        models.cache = self.cache.cache
+        notifications._notifier = self.previous_notifier
+        Blocking.drop_collection()
+        super(QueryBudgetTests, self).tearDown()
+
+    def populate(self):
+        Friend.objects.add_friend(self.user_bob, self.user_steve).accept()
+        self.request = Friend.objects.add_friend(self.user_susan, self.user_bob)
+        Inspiration.objects.add_inspiration(self.user_amy, self.user_bob)
+        Blocking.objects.add_blocking(self.user_susan, self.user_amy)
+        Friend.objects.tag_friends(self.user_bob, [self.user_steve], 'close')
+
+    def reset(self):
+        for document in (Friend, FriendshipRequest, Inspiration, Blocking):
+            document.objects.delete()
+
+    def assertBudget(self, budget, func, *args):
+        queries, cache_operations = budget
+        with measure(self.recorder, self.cache) as spent:
+            func(*args)
+
+        name = func.__name__
+        self.assertLessEqual(spent.queries, queries, "%s: %d queries, budget %d" % (
+            name, spent.queries, queries))
+        self.assertLessEqual(spent.cache, cache_operations, "%s: %d cache operations, budget %d" % (
+            name, spent.cache, cache_operations))
+
+    def assertReadBudget(self, cold, warm, func, *args):
+        """ Call func with empty caches, then with what it and `warm_caches` cached """
+        cache.clear()
+        self.assertBudget(cold, func, *args)
+        models.warm_caches(self.user_pks)
+        self.assertBudget(warm, func, *args)
+
+    def assertWriteBudget(self, cold, warm, func, *args):
+        """
+        Call func (or a method of the populated request) on a freshly
+        populated graph with empty caches, then with warmed caches
+        """
+        for budget, warm_up in ((cold, False), (warm, True)):
+            self.reset()
+            self.populate()
+            cache.clear()
+            if warm_up:
+                models.warm_caches(self.user_pks)
+            target = getattr(self.request, func) if isinstance(func, str) else func
+            self.assertBudget(budget, target, *args)
+
+    def test_friendship_reads(self):
+        bob, steve, susan = self.user_bob, self.user_steve, self.user_susan
+
+        self.assertReadBudget((2, 2), (0, 1), Friend.objects.friends, bob)
+        self.assertReadBudget((2, 4), (0, 2), Friend.objects.friends, bob, 'close')
+        self.assertReadBudget((2, 2), (0, 1), Friend.objects.recent_friends, bob)
+        self.assertReadBudget((2, 2), (0, 1), Friend.objects.requests, bob)
+        self.assertReadBudget((1, 2), (0, 1), Friend.objects.inbox, bob)
+        self.assertReadBudget((2, 2), (0, 1), Friend.objects.sent_requests, susan)
+        self.assertReadBudget((2, 2), (0, 1), Friend.objects.unread_requests, bob)
+        self.assertReadBudget((2, 2), (0, 1), Friend.objects.read_requests, bob)
+        self.assertReadBudget((2, 2), (0, 1), Friend.objects.rejected_requests, bob)
+        self.assertReadBudget((2, 2), (0, 1), Friend.objects.unrejected_requests, bob)
+        self.assertReadBudget((1, 2), (0, 1), Friend.objects.unread_request_count, bob)
+        self.assertReadBudget((1, 2), (0, 1), Friend.objects.unrejected_request_count, bob)
+        self.assertReadBudget((2, 6), (2, 6), Friend.objects.reconcile_request_counts, bob)
+        self.assertReadBudget((1, 2), (0, 2), Friend.objects.are_friends, bob, steve)
+        self.assertReadBudget((1, 6), (0, 2), Friend.objects.degree_of_separation, bob, steve)
+        self.assertReadBudget((2, 6), (1, 2), Friend.objects.connection_path, bob, steve)
+        self.assertReadBudget((2, 0), (2, 0), Friend.objects.friend_id_ranges, bob, 2)
+
+        def iter_friend_ids(user):
+            return list(Friend.objects.iter_friend_ids(user))
+        self.assertReadBudget((1, 0), (1, 0), iter_friend_ids, bob)
+
+    def test_friendship_writes(self):
+        bob, steve, amy = self.user_bob, self.user_steve, self.user_amy
+
+        self.assertWriteBudget((4, 7), (2, 7), Friend.objects.add_friend, amy, bob)
+        # notices about the new request dereference both users
+        notifications._notifier = RecordingNotifier()
+        self.assertWriteBudget((6, 7), (4, 7), Friend.objects.add_friend, amy, bob)
+        notifications._notifier = notifications.NullNotifier()
+        self.assertWriteBudget((2, 1), (2, 1), Friend.objects.remove_friend, bob, steve)
+        self.assertWriteBudget((3, 1), (3, 1), Friend.objects.remove_all_friends, bob)
+        self.assertWriteBudget((1, 1), (1, 1), Friend.objects.tag_friends, bob, [steve], 'best')
+        self.assertWriteBudget((1, 1), (1, 1), Friend.objects.untag_friends, bob, 'close')
+
+    def test_request_methods(self):
+        # the warmed unread counter of bob drops to 0 and is deleted
+        self.assertWriteBudget((6, 3), (6, 4), 'accept')
+        self.assertWriteBudget((3, 3), (3, 3), 'reject')
+        self.assertWriteBudget((3, 5), (3, 6), 'cancel')
+        self.assertWriteBudget((3, 3), (3, 4), 'mark_viewed')
+
+    def test_hot_account_reads(self):
+        previous = models.HOT_ACCOUNT_FOLLOWERS
+        # amy makes bob hot, his full follower list is never loaded
+        models.HOT_ACCOUNT_FOLLOWERS = 1
+        try:
+            self.assertReadBudget((3, 5), (0, 3), Inspiration.objects.inspired_by_user,
+                                  self.user_bob)
+            self.assertReadBudget((3, 8), (1, 4), models.warm_caches, self.user_pks,
+                                  ('inspirations',))
+        finally:
+            models.HOT_ACCOUNT_FOLLOWERS = previous
+
+    def test_inspiration_reads(self):
+        bob, steve, amy = self.user_bob, self.user_steve, self.user_amy
+
+        self.assertReadBudget((2, 3), (0, 1), Inspiration.objects.inspired_by_user, bob)
+        self.assertReadBudget((1, 2), (0, 1), Inspiration.objects.follower_count, bob)
+        self.assertReadBudget((1, 2), (0, 1), Inspiration.objects.is_hot, bob)
+        self.assertReadBudget((2, 2), (0, 1), Inspiration.objects.follower_page, bob)
+        self.assertReadBudget((2, 2), (0, 1), Inspiration.objects.new_followers, bob)
+        self.assertReadBudget((2, 2), (0, 1), Inspiration.objects.user_inspired_by, amy)
+        self.assertReadBudget((1, 1), (0, 1), Inspiration.objects.is_inspired, amy, bob)
+        self.assertReadBudget((1, 1), (0, 1), Inspiration.objects.inspired_map, amy, [bob, steve])
+        self.assertReadBudget((1, 1), (0, 1), Inspiration.objects.followers_among, bob, [amy, steve])
+        self.assertReadBudget((2, 0), (2, 0), Inspiration.objects.follower_id_ranges, bob, 2)
+
+        def iter_follower_ids(user):
+            return list(Inspiration.objects.iter_follower_ids(user))
+        self.assertReadBudget((1, 0), (1, 0), iter_follower_ids, bob)
+
+    def test_inspiration_writes(self):
+        bob, steve, amy = self.user_bob, self.user_steve, self.user_amy
+
+        self.assertWriteBudget((2, 5), (2, 5), Inspiration.objects.add_inspiration, steve, bob)
+        # the removed relationship is loaded and dereferenced for signals
+        self.assertWriteBudget((4, 5), (4, 5), Inspiration.objects.remove_inspiration, amy, bob)
+
+    def test_blocking_reads(self):
+        steve, susan, amy = self.user_steve, self.user_susan, self.user_amy
+
+        self.assertReadBudget((2, 2), (0, 1), Blocking.objects.blocked_for_user, susan)
+        self.assertReadBudget((2, 2), (0, 1), Blocking.objects.blocked_by, amy)
+        self.assertReadBudget((1, 1), (0, 1), Blocking.objects.is_blocked, susan, amy)
+        self.assertReadBudget((1, 1), (0, 1), Blocking.objects.is_blocked_either_way, susan, amy)
+        self.assertReadBudget((1, 1), (0, 1), Blocking.objects.filter_blocked, susan, [amy, steve])
+
+    def test_blocking_writes(self):
+        bob, steve, susan, amy = self.user_bob, self.user_steve, self.user_susan, self.user_amy
+
+        self.assertWriteBudget((5, 1), (5, 1), Blocking.objects.add_blocking, bob, steve)
+        self.assertWriteBudget((4, 4), (4, 4), Blocking.objects.remove_blocking, susan, amy)
@@ -0,0 +1,161 @@
+"""
+Test helpers recording the commands friendship sends to MongoDB
+and the operations it sends to the cache
+"""
+from contextlib import contextmanager
+
+try:
+    from pymongo import monitoring
+except ImportError:
+    # pymongo < 3.1
+    monitoring = None
+
+from friendship.compat import get_user_model
+from friendship.models import (Friend, FriendshipRequest, Inspiration, Blocking,
+    RelationshipSummary)
+from friendship.utils import reset_connections
+
+
+DOCUMENTS = (Friend, FriendshipRequest, Inspiration, Blocking, RelationshipSummary)
+
+# where the filter of a command is, for commands reading or writing documents
+FILTERS = {
+    'find': lambda command: [command.get('filter', {})],
+    'count': lambda command: [command.get('query', {})],
+    'distinct': lambda command: [command.get('query', {})],
+    'findAndModify': lambda command: [command.get('query', {})],
+    'findandmodify': lambda command: [command.get('query', {})],
+    'delete': lambda command: [d['q'] for d in command.get('deletes', [])],
+    'update': lambda command: [u['q'] for u in command.get('updates', [])],
+    'aggregate': lambda command: [
+        stage['$match'] for stage in command.get('pipeline', [])[:1] if '$match' in stage],
+}
+
+# index maintenance (mongoengine ensures indexes on first use), not queries
+IGNORED_COMMANDS = ('createIndexes',)
+
+
+class CommandRecorder(monitoring.CommandListener if monitoring else object):
+    """
+    Records (collection, command name, command) of every command sent
+    within `record()`
+    """
+
+    def __init__(self):
+        self.commands = []
+        self.recording = False
+
+    def started(self, event):
+        if self.recording:
+            command = event.command
+            self.commands.append((command.get(event.command_name),
+                                  event.command_name, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    @contextmanager
+    def record(self):
+        del self.commands[:]
+        self.recording = True
+        try:
+            yield self.commands
+        finally:
+            self.recording = False
+
+    def filters(self, collection=None):
+        """ Yield (command name, filter) of recorded commands """
+        for name, command_name, command in self.commands:
+            if collection is not None and name != collection:
+                continue
+            for query in FILTERS.get(command_name, lambda command: [])(command):
+                yield command_name, query
+
+
+class CacheRecorder(object):
+    """
+    Wraps a cache (e.g. `friendship.models.cache`), recording the names
+    of operations called within `record()`
+    """
+    OPERATIONS = frozenset(['get', 'get_many', 'set', 'set_many', 'add',
+                            'incr', 'decr', 'delete', 'delete_many'])
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.operations = []
+        self.recording = False
+
+    def __getattr__(self, name):
+        if self.recording and name in self.OPERATIONS:
+            self.operations.append(name)
+        return getattr(self.cache, name)
+
+    @contextmanager
+    def record(self):
+        del self.operations[:]
+        self.recording = True
+        try:
+            yield self.operations
+        finally:
+            self.recording = False
+
+
+class Spent(object):
+    """ Mongo commands and cache operations of a `measure` block """
+    queries = 0
+    cache = 0
+
+
+@contextmanager
+def measure(recorder, cache_recorder):
+    """ Count queries and cache operations sent within the block """
+    spent = Spent()
+    with recorder.record() as commands:
+        with cache_recorder.record() as operations:
+            yield spent
+    spent.queries = len([c for c in commands if c[1] not in IGNORED_COMMANDS])
+    spent.cache = len(operations)
+
+
+recorder = None
+
+
+def install_recorder():
+    """
+    Register the shared CommandRecorder (None with pymongo < 3.1).
+    Listeners only apply to clients created afterwards, so connections
+    of friendship documents are reopened.
+    """
+    global recorder
+    if recorder is None and monitoring is not None:
+        recorder = CommandRecorder()
+        monitoring.register(recorder)
+        reset_connections(DOCUMENTS + (get_user_model(),))
+    return recorder
+
+
+def targets_single_shard(query, shard_key):
+    """
+    Does the filter pin the shard key to a single value, so mongos can
+    route it to one shard?
+    """
+    value = query.get(shard_key)
+    if isinstance(value, dict):
+        return set(value) == set(['$eq']) or (
+            set(value) == set(['$in']) and len(value['$in']) == 1)
+    return value is not None
+
+
+def explain_targets_single_shard(queryset):
+    """
+    Ask mongos whether the queryset targets a single shard, None if
+    not connected to a sharded cluster
+    """
+    plan = queryset.explain()
+    winning = plan.get('queryPlanner', {}).get('winningPlan', {})
+    if 'shards' not in winning:
+        return None
+    return winning.get('stage') == 'SINGLE_SHARD'
@@ -0,0 +1,56 @@
+def chunked(iterable, size):
+    """
+    Split iterable into lists of at most `size` items
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def split_id_ranges(queryset, parts):
+    """
+    Split queryset into at most `parts` disjoint `_id` ranges of about
+    the same size. Every range is an (after, until) pair: `after` is
+    exclusive, `until` is inclusive and None means unbounded.
+
+    Boundaries are picked in a single pass over the ordered `_id`s,
+    rather than a `skip` per boundary.
+    """
+    from friendship.settings import STREAM_BATCH_SIZE
+
+    total = queryset.count()
+    positions = set(total * i // parts - 1 for i in range(1, parts)
+                    if total * i // parts)
+    bounds = [None]
+
+    if positions:
+        last = max(positions)
+        qs = queryset.order_by('id').limit(last + 1).only('id')\
+            .as_pymongo().batch_size(STREAM_BATCH_SIZE)
+        for position, doc in enumerate(qs):
+            if position in positions and doc['_id'] != bounds[-1]:
+                bounds.append(doc['_id'])
+
+    bounds.append(None)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def reset_connections(documents):
+    """
+    Drop MongoDB connections inherited from the parent process (pymongo
+    clients aren't fork-safe), documents reconnect on their next query.
+    Meant to be a `multiprocessing.Pool` initializer.
+    """
+    from mongoengine.connection import disconnect, DEFAULT_CONNECTION_NAME
+
+    for alias in set(d._meta.get('db_alias') or DEFAULT_CONNECTION_NAME
+                     for d in documents):
+        disconnect(alias)
+
+    for document in documents:
+        document._collection = None